@@ -1,12 +1,26 @@
 import sys
-from PyQt5.QtWidgets import QApplication
+import asyncio
+import qasync
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QApplication, QStyleFactory
 from src.ui.main_window import CNCWindow
+from src.ui import styles
 
 if __name__ == "__main__":
+    # Must be set before the QApplication exists
+    QApplication.setAttribute(Qt.AA_CompressHighFrequencyEvents, True)
+    QApplication.setAttribute(Qt.AA_DontCreateNativeWidgetSiblings, True)
+
     app = QApplication(sys.argv)
-    app.setStyle('Fusion')
-    
+    app.setStyle(QStyleFactory.create('Fusion'))
+    styles.install(app)
+
+    # Qt event loop doubles as the asyncio loop (MacroRunner is a coroutine)
+    loop = qasync.QEventLoop(app)
+    asyncio.set_event_loop(loop)
+
     window = CNCWindow()
     window.show()
-    
-    sys.exit(app.exec_())
+
+    with loop:
+        loop.run_forever()
@@ -1,11 +1,19 @@
+import asyncio
+import math
+import operator
 import re
+import time
+from array import array
+from bisect import bisect_right
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple, Union
+from enum import IntEnum
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 from PyQt5.QtCore import QObject, pyqtSignal, QTimer
 
 
-@dataclass
+@dataclass(slots=True)
 class CallFrame:
     return_index: int
     return_scope: str
@@ -17,6 +25,44 @@ class CallFrame:
 Number = Union[int, float]
 
 
+def _fail(error: Exception):
+    # Used by compiled conditions to raise a stored compile error
+    raise error
+
+
+class Op(IntEnum):
+    """
+    Per-line opcode compiled by parse_script (see MacroRunner.ops).
+    """
+    BLANK = 0     # blank / comment / label-only line
+    SEND = 1      # controller line: (text without leading N, [expr] template or None)
+    ASSIGN = 2    # #var = expr: (var number, compiled expr)
+    IF_GOTO = 3   # IF [cond] THEN GOTO N: (compiled cond, target N, dest index or -1, dest scope)
+    IF_OTHER = 4  # IF [cond] THEN <unsupported>: (compiled cond, action text)
+    M98 = 5       # subprogram call: (sub name, repeat, text)
+    M99 = 6       # subprogram return: ()
+    GOTO = 7      # unconditional GOTO: (target N, dest index or -1, dest scope)
+    SKIP_SUB = 8  # O#### header reached by fall-through: (sub name,)
+
+
+class Tag(IntEnum):
+    """
+    Expression token types produced by MacroRunner._tokenize_expr.
+    """
+    NUM = 0     # (NUM, float)
+    VAR = 1     # (VAR, resolved var number)
+    OP = 2      # (OP, "+" "-" "*" "/" "MOD")
+    LPAREN = 3  # (LPAREN, "(")
+    RPAREN = 4  # (RPAREN, ")")
+    BAD = 5     # (BAD, text) - reported by _to_rpn as unknown token
+
+
+# Runner states (MacroRunner.state)
+IDLE = 0   # no macro running
+RUN = 1    # running, nothing waiting for 'ok'
+WAIT = 2   # running, at least one command waiting for 'ok'
+
+
 class MacroRunner(QObject):
     """
     PC-side macro interpreter with 'ok' handshake.
@@ -34,57 +80,112 @@ class MacroRunner(QObject):
       - Real motion/commands lines (G0/G1/M... etc) that are not macro-control.
     """
 
+    # Fixed attribute set: slot descriptors instead of dict lookups on the hot path
+    # (sip still gives QObject subclasses a __dict__, so this is not a hard lock).
+    __slots__ = (
+        "_text", "_offsets", "line_count", "ops", "actions",
+        "state", "debug_mode", "window_size", "_inflight",
+        "current_index", "current_scope",
+        "vars", "_sparse_vars", "named_vars", "_next_named_var", "_var_token_cache",
+        "machine_pos", "sys_vars_map",
+        "label_maps", "_expr_ns", "subprograms", "call_stack",
+        "speed_override", "_feed_cache", "_feed_cache_factor",
+        "_task", "_ok_event", "_step_event",
+        "watchdog_timeout_ms", "_cmd_sent_ns", "_heartbeat",
+        "_last_emit_ms", "_emit_interval_ms", "_line_timer", "_pending_line",
+        "_shown_line",
+    )
+
     command_to_send = pyqtSignal(str)
     log_message = pyqtSignal(str)
     current_line_changed = pyqtSignal(int)
     finished = pyqtSignal()
 
+    # Local (non-sent) lines executed before _run yields to the event loop
+    LOCAL_SLICE = 256
+    # Variables #0 .. DENSE_VARS-1 live in a fixed list; higher numbers are sparse
+    DENSE_VARS = 1024
+    # Control-flow ops: _run drains the 'ok' window before executing them
+    JUMP_OPS = frozenset((Op.GOTO, Op.IF_GOTO, Op.M98, Op.M99))
+
     # ---------------- Regex ----------------
     _re_block_comment = re.compile(r"\([^)]*\)")  # remove (...) blocks on same line
     _re_leading_n = re.compile(r"^\s*N(\d+)\b", re.IGNORECASE)
     _re_o_sub = re.compile(r"^\s*O(\d+)\s*$", re.IGNORECASE)
+    # First characters of every PC-interpreted line (O####, #var =, IF, M98/M99)
+    _local_heads = frozenset("O#IM")
+    # Leading N label + optional unconditional GOTO, matched once per line at parse time
+    _re_line_head = re.compile(r"^\s*(?:N(\d+)\b)?\s*(?:(GOTO)\s+(\d+)\s*$)?", re.IGNORECASE)
 
-    _re_uncond_goto = re.compile(r"^\s*GOTO\s+(\d+)\s*$", re.IGNORECASE)
-    _re_if_then = re.compile(r"^\s*IF\s*\[(.+?)\]\s*THEN\s*(.+)\s*$", re.IGNORECASE)
+    # IF / GOTO / M98 / assignment are only matched against the upper-cased
+    # upper-cased line text built by parse_script, so they are compiled case-sensitive.
+    _re_uncond_goto = re.compile(r"^\s*GOTO\s+(\d+)\s*$")
+    _re_if_then = re.compile(r"^\s*IF\s*\[(.+?)\]\s*THEN\s*(.+)\s*$")
 
     # M98 P1000  OR  M98 P1000 L3
-    _re_m98 = re.compile(r"^\s*M98\s+P(\d+)(?:\s+L(\d+))?\s*$", re.IGNORECASE)
+    _re_m98 = re.compile(r"^\s*M98\s+P(\d+)(?:\s+L(\d+))?\s*$")
     _re_m99 = re.compile(r"^\s*M99\b", re.IGNORECASE)
 
     # Assignment: #100 = expr
-    _re_assign = re.compile(r"^\s*#([A-Za-z_][\w\.]*|\d+)\s*=\s*(.+?)\s*$", re.IGNORECASE)
+    _re_assign = re.compile(r"^\s*#([A-Z_][\w\.]*|\d+)\s*=\s*(.+?)\s*$")
 
     # Condition operators (Delta macro style)
     _cond_ops = ("EQ", "NE", "GT", "GE", "LT", "LE")
-
-    # Tokenizer for arithmetic expressions (numbers, #vars, operators, parentheses)
-    _re_token = re.compile(r"""
-        \s*(
-            \#[A-Za-z_][\w\.]* |  # variable name  #Counter or #robot0.HOME_Z
-            \#\d+              |  # variable number #100
-            \d+(?:\.\d+)?      |  # number
-            [+\-*/()]          |
-            \bMOD\b            |
-            .
-        )
-    """, re.IGNORECASE | re.VERBOSE)
+    _cond_op_res = {op: re.compile(rf"\b{op}\b", re.IGNORECASE) for op in _cond_ops}
+    _cond_syms = {"EQ": "==", "NE": "!=", "GT": ">", "GE": ">=", "LT": "<", "LE": "<="}
+    _re_or = re.compile(r"\bOR\b", re.IGNORECASE)
+    _re_and = re.compile(r"\bAND\b", re.IGNORECASE)
+
+    # Spacing normalization (IF[ -> IF [, ]THEN -> ] THEN, collapse whitespace)
+    _re_if_bracket = re.compile(r"\bIF\s*\[", re.IGNORECASE)
+    _re_then = re.compile(r"\]\s*THEN\b", re.IGNORECASE)
+    _re_spaces = re.compile(r"\s+")
+
+    # [expr] blocks in controller lines, and F<feed> for speed override
+    _re_bracket_expr = re.compile(r"\[(.*?)\]")
+    _re_feed = re.compile(r"([Ff])\s*(\d+(?:\.\d+)?)")
+
+    # Macro arithmetic operator -> Python operator for compiled expressions,
+    # and the matching function used to fold constant sub-expressions
+    _arith_ops = {"+": "+", "-": "-", "*": "*", "/": "/", "MOD": "%"}
+    _arith_fns = {"+": operator.add, "-": operator.sub, "*": operator.mul,
+                  "/": operator.truediv, "MOD": operator.mod}
+
+    # Character classes for the expression tokenizer
+    _digits = frozenset("0123456789")
+    _ident_start = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_")
+    _single_tokens = {
+        "+": (Tag.OP, "+"), "-": (Tag.OP, "-"), "*": (Tag.OP, "*"), "/": (Tag.OP, "/"),
+        "(": (Tag.LPAREN, "("), ")": (Tag.RPAREN, ")"),
+    }
 
     def __init__(self):
         super().__init__()
 
-        self.lines: List[str] = []
-        self.is_running: bool = False
-        self.waiting_for_ok: bool = False
+        # Script kept as one string + line start offsets (no per-line str objects)
+        self._text: str = ""
+        self._offsets = array("l")
+        self.line_count: int = 0
+        self.ops: List[Tuple[Op, tuple]] = []
+        self.actions: List[Callable[[], Optional[str]]] = []  # per-line handler, see parse_script
+        self.state: int = IDLE
+        # 'ok' credit window: up to window_size commands may be un-acked
+        self.window_size: int = 4
+        self._inflight: int = 0
         self.debug_mode: bool = False
 
         self.current_index: int = 0
         self.current_scope: str = "MAIN"  # "MAIN" or "O####"
 
-        # Variables: #100, #101 ...
-        # Variables: #100, #101 ...
-        self.vars: Dict[int, float] = {}
+        # Variables: #100, #101 ... indexed directly by number (named vars
+        # from 1000 up). Fixed size, never replaced (see _expr_ns); numbers
+        # >= DENSE_VARS go to _sparse_vars so "#20000000" costs one dict entry.
+        self.vars: List[float] = [0.0] * self.DENSE_VARS
+        self._sparse_vars: Dict[int, float] = {}
         self.named_vars: Dict[str, int] = {}
         self._next_named_var = 1000
+        # Raw token ("#Counter", "#100") -> var number, filled by _resolve_var
+        self._var_token_cache: Dict[str, int] = {}
         
         # Machine Position (System Variables)
         self.machine_pos = {'X': 0.0, 'Y': 0.0, 'Z': 0.0}
@@ -102,33 +203,107 @@ class MacroRunner(QObject):
 
         # Call stack
         self.call_stack: List[CallFrame] = []
+
+        # Namespace of compiled expressions (see _src_to_fn)
+        self._expr_ns = {"__builtins__": {}, "float": float, "bool": bool,
+                         "get": self.get_var, "v": self.vars, "fail": _fail}
         
 
-        # Watchdog
-        self.watchdog = QTimer()
-        self.watchdog.setSingleShot(True)
-        self.watchdog.timeout.connect(self.on_watchdog_timeout)
+        # Feed-rate override factor (1.0 = 100%)
+        self.speed_override: float = 1.0
+        # Overridden text of static lines, valid for _feed_cache_factor
+        self._feed_cache: Dict[str, str] = {}
+        self._feed_cache_factor: float = 1.0
+
+        # Execution coroutine + handshake events (driven by the qasync loop)
+        self._task: Optional[asyncio.Future] = None
+        self._ok_event = asyncio.Event()
+        self._step_event = asyncio.Event()
+
+        # Watchdog: one 100 ms heartbeat compares against the last send/ok time
+        # instead of re-arming a timer for every command.
         self.watchdog_timeout_ms = 5000
+        self._cmd_sent_ns = 0
+        self._heartbeat = QTimer()
+        self._heartbeat.setInterval(100)
+        self._heartbeat.timeout.connect(self._check_timeout)
+
+        # UI signal throttling: line highlight at most every _emit_interval_ms,
+        # log lines go straight out (CNCWindow batches its terminal writes,
+        # so they stay in order with the [TX] lines it logs).
+        self._last_emit_ms = 0
+        self._emit_interval_ms = 40
+        # Trailing edge: a suppressed highlight is flushed once the interval ends
+        self._line_timer = QTimer()
+        self._line_timer.setSingleShot(True)
+        self._line_timer.timeout.connect(self._flush_line)
+        self._pending_line = -1
+        # Debug mode: line already highlighted (the next line, while paused)
+        self._shown_line = -1
+
+    # ---------------- UI signals ----------------
+    def _log(self, message: str):
+        self.log_message.emit(message)
+
+    def _emit_line(self):
+        """
+        Emit current_line_changed, throttled to _emit_interval_ms.
+        The last line is always emitted; a suppressed line is emitted by
+        _line_timer when the interval ends, so the highlight never stays
+        behind on the last line that was actually sent.
+        Debug mode emits each line once: shown while paused, not again when
+        STEP executes it.
+        """
+        if self.debug_mode:
+            if self.current_index != self._shown_line:
+                self._shown_line = self.current_index
+                self.current_line_changed.emit(self.current_index)
+            return
+        now = time.monotonic_ns() // 1_000_000
+        elapsed = now - self._last_emit_ms
+        if (elapsed >= self._emit_interval_ms
+                or self.current_index == self.line_count - 1):
+            self._line_timer.stop()
+            self.current_line_changed.emit(self.current_index)
+            self._last_emit_ms = now
+        else:
+            self._pending_line = self.current_index
+            if not self._line_timer.isActive():
+                self._line_timer.start(self._emit_interval_ms - elapsed)
+
+    def _flush_line(self):
+        if self.state == IDLE:
+            return
+        self.current_line_changed.emit(self._pending_line)
+        self._last_emit_ms = time.monotonic_ns() // 1_000_000
+
     def set_speed_override(self, factor: float):
         self.speed_override = factor
-        self.log_message.emit(f"Speed override set to {factor*100:.0f}%")
+        self._log(f"Speed override set to {factor*100:.0f}%")
 
     def _resolve_var(self, token: str) -> int:
+        var_num = self._var_token_cache.get(token)
+        if var_num is not None:
+            return var_num
+
         # #100
         if token[1:].isdigit():
-            return int(token[1:])
+            var_num = int(token[1:])
+        else:
+            # #Counter or #robot0.HOME_Z
+            name = token[1:].upper()
+
+            if name in self.sys_vars_map:
+                var_num = self.sys_vars_map[name]
+            else:
+                if name not in self.named_vars:
+                    self.named_vars[name] = self._next_named_var
+                    self._next_named_var += 1
+                var_num = self.named_vars[name]
+
+        self._var_token_cache[token] = var_num
+        return var_num
 
-        # #Counter or #robot0.HOME_Z
-        name = token[1:].upper()
-        
-        if name in self.sys_vars_map:
-            return self.sys_vars_map[name]
-            
-        if name not in self.named_vars:
-            self.named_vars[name] = self._next_named_var
-            self._next_named_var += 1
-        return self.named_vars[name]
-        
     def update_machine_position(self, x: float, y: float, z: float):
         self.machine_pos['X'] = x
         self.machine_pos['Y'] = y
@@ -146,7 +321,8 @@ class MacroRunner(QObject):
         semi = line.find(';')
         if semi != -1:
             line = line[:semi]
-        line = self._re_block_comment.sub("", line)
+        if '(' in line:  # most lines have no block comment: skip the regex
+            line = self._re_block_comment.sub("", line)
         return line.strip()
 
     def normalize_spacing(self, line: str) -> str:
@@ -157,9 +333,10 @@ class MacroRunner(QObject):
         Do NOT attempt to rewrite inside-condition spacing aggressively.
         """
         s = line
-        s = re.sub(r"\bIF\s*\[", "IF [", s, flags=re.IGNORECASE)
-        s = re.sub(r"\]\s*THEN\b", "] THEN", s, flags=re.IGNORECASE)
-        s = re.sub(r"\s+", " ", s).strip()
+        if '[' in s:  # both patterns need a bracket
+            s = self._re_if_bracket.sub("IF [", s)
+            s = self._re_then.sub("] THEN", s)
+        s = self._re_spaces.sub(" ", s).strip()
         return s
 
     def preprocess_line(self, raw_line: str) -> str:
@@ -180,22 +357,52 @@ class MacroRunner(QObject):
         return n_val, rest
 
     # ---------------- Parsing ----------------
+    def _index_lines(self, text: str):
+        """
+        Record the start offset of every line of text (split on '\n'),
+        plus one sentinel so line i always ends at _offsets[i + 1] - 1.
+        """
+        offsets = array("l", [0])
+        find = text.find
+        pos = find("\n")
+        while pos != -1:
+            offsets.append(pos + 1)
+            pos = find("\n", pos + 1)
+        if offsets[-1] != len(text):  # no trailing newline: sentinel past the end
+            offsets.append(len(text) + 1)
+
+        self._text = text
+        self._offsets = offsets
+        self.line_count = len(offsets) - 1
+
+    def _line(self, i: int) -> str:
+        """
+        Raw text of line i, sliced out of the script on demand.
+        """
+        return self._text[self._offsets[i]:self._offsets[i + 1] - 1]
+
     def parse_script(self, script_text: str):
-        self.lines = script_text.splitlines()
+        self._index_lines(script_text)
 
         self.label_maps = {"MAIN": {}}
         self.subprograms = {}
         self.call_stack = []
         self.current_scope = "MAIN"
+        self._feed_cache.clear()
 
         # Variables reset each run (you can keep if you want persistent)
-        self.vars = {}
+        self.vars[:] = [0.0] * len(self.vars)
+        self._sparse_vars.clear()
+
+        # Strip comments / normalize spacing once per line; every pass below
+        # reads this list (the regexes are case-insensitive, no upper() needed)
+        clean = [self.preprocess_line(self._line(i)) for i in range(self.line_count)]
 
         # 1) Identify subprogram blocks O#### ... M99
         idx = 0
-        while idx < len(self.lines):
-            line = self.preprocess_line(self.lines[idx]).upper()
-            
+        while idx < self.line_count:
+            line = clean[idx]
+
             # Strip N number if present (e.g. N40 O2000)
             _n, rest_line = self.split_leading_n(line)
             
@@ -203,13 +410,13 @@ class MacroRunner(QObject):
             if m_o:
                 sub_name = int(m_o.group(1))
                 o_line_index = idx
-                first_exec_index = min(idx + 1, len(self.lines))
+                first_exec_index = min(idx + 1, self.line_count)
 
                 end_idx = None
                 j = idx + 1
-                while j < len(self.lines):
-                    lj = self.preprocess_line(self.lines[j]).upper()
-                    
+                while j < self.line_count:
+                    lj = clean[j]
+
                     # Strip N number for end check too (e.g. N75 M99)
                     _nj, rest_j = self.split_leading_n(lj)
                     
@@ -221,7 +428,7 @@ class MacroRunner(QObject):
                     j += 1
 
                 if end_idx is None:
-                    end_idx = len(self.lines) - 1
+                    end_idx = self.line_count - 1
 
                 self.subprograms[sub_name] = (o_line_index, first_exec_index, end_idx)
                 self.label_maps[f"O{sub_name}"] = {}
@@ -231,120 +438,391 @@ class MacroRunner(QObject):
 
             idx += 1
 
-        # 2) Build label maps by scope
-        scope_by_line = ["MAIN"] * len(self.lines)
-        for sub_name, (o_idx, _, end_idx) in self.subprograms.items():
-            scope = f"O{sub_name}"
-            for k in range(o_idx, end_idx + 1):
-                scope_by_line[k] = scope
-
-        for i, raw in enumerate(self.lines):
-            cleaned = self.preprocess_line(raw)
+        # 2) Scope of a line: bisect the sorted subprogram ranges, only asked
+        #    for lines that carry a label or a GOTO.
+        sub_ranges = sorted((o_idx, end_idx, f"O{sub_name}")
+                            for sub_name, (o_idx, _, end_idx) in self.subprograms.items())
+        sub_starts = [r[0] for r in sub_ranges]
+
+        def scope_of(i: int) -> str:
+            k = bisect_right(sub_starts, i) - 1
+            if k >= 0 and i <= sub_ranges[k][1]:
+                return sub_ranges[k][2]
+            return "MAIN"
+
+        # 3) Split off N labels and unconditional GOTOs with one regex match
+        #    per line; everything else is kept (text, upper text) for step 5.
+        self.ops = [(Op.BLANK, ())] * self.line_count
+        # Upper-cased CMD text per line ("" otherwise), only needed while parsing
+        norm = [""] * self.line_count
+        # Repeated command lines (e.g. thousands of identical moves) share one str
+        interned: Dict[str, str] = {}
+        for i, cleaned in enumerate(clean):
             if not cleaned:
                 continue
-            scope = scope_by_line[i]
-            # Map N labels
-            n, _rest = self.split_leading_n(cleaned.upper())
-            if n is not None:
-                self.label_maps.setdefault(scope, {})[n] = i
+            m = self._re_line_head.match(cleaned)
+            if m.group(1) is not None:
+                self.label_maps.setdefault(scope_of(i), {})[int(m.group(1))] = i
+            if m.group(2):
+                self.ops[i] = (Op.GOTO, (int(m.group(3)),))
+                continue
+            rest = cleaned[m.end():].strip() if m.group(1) is not None else cleaned
+            if rest:
+                rest = interned.setdefault(rest, rest)
+                u_rest = rest.upper()
+                self.ops[i] = (Op.SEND, (rest, None))
+                norm[i] = interned.setdefault(u_rest, u_rest)
+
+        # 4) Compile PC-side lines (O/#/IF/M9x) into opcodes with their
+        #    expressions already compiled; everything else stays SEND with
+        #    its [expr] blocks compiled into a template.
+        for i, (op, args) in enumerate(self.ops):
+            if op == Op.SEND:
+                if norm[i][0] in self._local_heads:
+                    self.ops[i] = self._compile_local(args[0], norm[i])
+                else:
+                    self.ops[i] = self._compile_send(args[0])
+
+        # 5) Labels are static: resolve every GOTO / IF-GOTO to its destination now
+        for i, (op, args) in enumerate(self.ops):
+            if op == Op.GOTO:
+                target_n = args[0]
+                dest, dest_scope = self._resolve_goto(target_n, scope_of(i))
+                self.ops[i] = (Op.GOTO, (target_n, dest, dest_scope))
+            elif op == Op.IF_GOTO:
+                cond, target_n = args
+                dest, dest_scope = self._resolve_goto(target_n, scope_of(i), prefer_main=True)
+                self.ops[i] = (Op.IF_GOTO, (cond, target_n, dest, dest_scope))
+
+        # 6) Bind one handler per line so execution is a single indexed call
+        dispatch = {
+            Op.BLANK: self._skip_line,
+            Op.SEND: self._build_command,
+            Op.ASSIGN: self._op_assign,
+            Op.IF_GOTO: self._op_if_goto,
+            Op.IF_OTHER: self._op_if_other,
+            Op.M98: self._op_m98,
+            Op.M99: self._op_m99,
+            Op.GOTO: self._goto,
+            Op.SKIP_SUB: self._op_skip_sub,
+        }
+        self.actions = [partial(dispatch[op], *args) for op, args in self.ops]
+
+    def _compile_local(self, rest: str, u_rest: str) -> Tuple[Op, tuple]:
+        """
+        Classify a PC-interpreted line once. Expressions that fail to compile
+        keep their exception, raised when (and only if) the line executes.
+        """
+        # 0) Subprogram header O#### (only reached by falling through)
+        m_o = self._re_o_sub.match(u_rest)
+        if m_o:
+            return Op.SKIP_SUB, (int(m_o.group(1)),)
+
+        # 1) Assignment: #100 = expr
+        m_as = self._re_assign.match(u_rest)
+        if m_as:
+            var_num = self._resolve_var("#" + m_as.group(1))
+            return Op.ASSIGN, (var_num, self._try_compile(self.compile_arith, m_as.group(2)))
+
+        # 2) IF [cond] THEN action
+        m_if = self._re_if_then.match(u_rest)
+        if m_if:
+            cond = self._try_compile(self.compile_condition, m_if.group(1).strip())
+            action = m_if.group(2).strip()
+            m_g = self._re_uncond_goto.match(action)
+            if m_g:
+                return Op.IF_GOTO, (cond, int(m_g.group(1)))
+            return Op.IF_OTHER, (cond, action)
+
+        # 3) M98 P#### [L<count>]
+        m98 = self._re_m98.match(u_rest)
+        if m98:
+            repeat = int(m98.group(2)) if m98.group(2) else 1
+            return Op.M98, (int(m98.group(1)), max(repeat, 1), rest)
+
+        # 4) M99
+        if self._re_m99.match(u_rest):
+            return Op.M99, ()
+
+        return self._compile_send(rest)
+
+    def _compile_send(self, rest: str) -> Tuple[Op, tuple]:
+        """
+        Split a controller line on its [expr] blocks into a template of
+        literal strings and compiled expressions. Pure-number blocks are
+        formatted now; a line left with no expressions is sent as is.
+        """
+        if "[" not in rest:
+            return Op.SEND, (rest, None)
+
+        chunks = self._re_bracket_expr.split(rest)  # literal, expr, literal, ...
+        parts: List[object] = [chunks[0]]
+        for k in range(1, len(chunks), 2):
+            try:
+                src, const = self._compile_arith_src(chunks[k])
+                part = f"{const:g}" if const is not None else self._src_to_fn(src)
+            except Exception as e:
+                part = e  # raised by _build_command if the line executes
+            if isinstance(part, str):
+                parts[-1] += part + chunks[k + 1]
+            else:
+                parts.extend((part, chunks[k + 1]))
+
+        if len(parts) == 1:
+            return Op.SEND, (parts[0], None)
+        return Op.SEND, (rest, parts)
+
+    @staticmethod
+    def _try_compile(compiler: Callable, text: str):
+        try:
+            return compiler(text)
+        except Exception as e:
+            return e
+
+    def _resolve_goto(self, target_n: int, scope: str, prefer_main: bool = False) -> Tuple[int, str]:
+        """
+        GOTO lookup: prefer labels of the given scope, then MAIN.
+        IF-GOTO (prefer_main) looks in MAIN first, then the given scope.
+        Returns (-1, scope) if the label does not exist.
+        """
+        order = ("MAIN", scope) if prefer_main else (scope, "MAIN")
+        for sc in order:
+            scope_map = self.label_maps.get(sc, {})
+            if target_n in scope_map:
+                return scope_map[target_n], sc
+        return -1, scope
 
     # ---------------- Control ----------------
     def start_macro(self, script_text: str, is_debug: bool = False):
-        if self.is_running:
+        if self.state != IDLE:
             return
 
         self.parse_script(script_text)
-        if not self.lines:
-            self.log_message.emit("Macro is empty.")
+        if not self.line_count:
+            self._log("Macro is empty.")
             return
 
-        self.is_running = True
+        self.state = RUN
         self.debug_mode = is_debug
-        self.waiting_for_ok = False
+        self._inflight = 0
+        self._last_emit_ms = 0
+        self._shown_line = -1
+        self._heartbeat.start()
 
-        self.current_index = 0
+        self.current_index = self._skip_lines(0)
         self.current_scope = "MAIN"
         self.call_stack = []
 
         mode_str = "DEBUG MODE" if is_debug else "NORMAL RUN"
-        self.log_message.emit(f"--- MACRO STARTED ({mode_str}) ---")
+        self._log(f"--- MACRO STARTED ({mode_str}) ---")
 
         if self.debug_mode:
-            self.log_message.emit("Paused. Press 'STEP' to execute line 0.")
-            self.current_line_changed.emit(self.current_index)
-            return
+            self._log(f"Paused. Press 'STEP' to execute line {self.current_index}.")
+            self._emit_line()
 
-        self.run_current_line()
+        self._task = asyncio.ensure_future(self._run())
 
     def step(self):
-        if not self.is_running:
+        if self.state == IDLE:
             return
-        if self.waiting_for_ok:
-            self.log_message.emit("Waiting for 'ok' from controller...")
+        if self.state == WAIT:
+            self._log("Waiting for 'ok' from controller...")
             return
-        self.run_current_line()
+        self._step_event.set()
 
     def stop_macro(self):
-        self.is_running = False
+        self.state = IDLE
         self.debug_mode = False
-        self.waiting_for_ok = False
-        self.watchdog.stop()
+        self._inflight = 0
         self.call_stack.clear()
-        self.log_message.emit("--- MACRO STOPPED ---")
+
+        self._heartbeat.stop()
+        self._line_timer.stop()
+
+        # Cancel the run coroutine unless we are being called from inside it
+        task, self._task = self._task, None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+        self._log("--- MACRO STOPPED ---")
         self.finished.emit()
 
+    # ---------------- Execution loop ----------------
+    async def _run(self):
+        """
+        Single coroutine driving the whole macro:
+          - local lines (assign/IF/GOTO/M98/M99) are executed inline
+          - controller lines are emitted while fewer than window_size
+            commands are waiting for 'ok' (1 in debug mode)
+        Control-flow lines (GOTO/IF GOTO/M98/M99) and end of program drain
+        the window first.
+        The watchdog (_check_timeout) cancels this task if 'ok' never comes.
+        """
+        local_steps = 0
+        jump_ops = self.JUMP_OPS
+        while self.state != IDLE:
+            if self.current_index >= self.line_count:
+                if await self._wait_inflight_below(1):
+                    self.stop_macro()
+                return
+
+            if self.debug_mode:
+                self._step_event.clear()
+                await self._step_event.wait()
+                if self.state == IDLE:
+                    return
+
+            # Every jump waits until the controller has acked what was sent
+            # before it: IF conditions may read the machine position
+            # (#-1..#-3), and loop/subprogram boundaries then line up with
+            # the machine instead of running up to window_size lines ahead.
+            if self._inflight and self.ops[self.current_index][0] in jump_ops:
+                if not await self._wait_inflight_below(1):
+                    return
+
+            cmd = self.run_current_line()
+            if cmd is None:
+                # Local lines (assign/IF/GOTO/M98/M99) run back to back; yield
+                # once per LOCAL_SLICE of them so local loops keep the UI alive.
+                local_steps += 1
+                if local_steps >= self.LOCAL_SLICE:
+                    local_steps = 0
+                    await asyncio.sleep(0)
+                continue
+            local_steps = 0
+
+            window = 1 if self.debug_mode else max(1, self.window_size)
+            if not await self._wait_inflight_below(window):
+                return
+            self._inflight += 1
+            self.state = WAIT
+            self._cmd_sent_ns = time.monotonic_ns()
+            self.command_to_send.emit(cmd)
+            self.current_index = self._skip_lines(self.current_index + 1)
+
+            if self.debug_mode:
+                if not await self._wait_inflight_below(1):
+                    return
+                if self.current_index < self.line_count:
+                    self._log(f"Debug: Line finished. Next line: {self.current_index}")
+                    self._emit_line()
+
+    async def _wait_inflight_below(self, limit: int) -> bool:
+        """
+        Await 'ok' replies until fewer than limit commands are in flight.
+        Returns False if the macro stopped meanwhile.
+        """
+        while self._inflight >= limit:
+            self._ok_event.clear()
+            await self._ok_event.wait()
+            if self.state == IDLE:
+                return False
+        return True
+
     # ---------------- Execution helpers ----------------
+    def _skip_lines(self, index: int) -> int:
+        """
+        Return the first index >= index that is not a BLANK line (or len(lines)).
+        Runs of blank/comment lines cost a pointer bump, not a loop iteration.
+        """
+        ops = self.ops
+        n = len(ops)
+        while index < n and ops[index][0] == Op.BLANK:
+            index += 1
+        return index
+
     def _advance(self, next_index: int, next_scope: Optional[str] = None):
-        self.current_index = next_index
+        self.current_index = self._skip_lines(next_index)
         if next_scope is not None:
             self.current_scope = next_scope
 
-        if self.current_index >= len(self.lines):
-            self.stop_macro()
-            return
-
-        self.current_line_changed.emit(self.current_index)
+        if self.current_index >= self.line_count:
+            return  # _run drains outstanding 'ok's and stops
 
         if self.debug_mode:
-            self.log_message.emit("Debug: Ready. Press 'STEP' to execute.")
-            return
-
-        QTimer.singleShot(0, self.run_current_line)
-
-    def _send_and_wait_ok(self, line: str):
-        self.waiting_for_ok = True
-        self.command_to_send.emit(line)
-        self.watchdog.start(self.watchdog_timeout_ms)
+            self._emit_line()
+            self._log("Debug: Ready. Press 'STEP' to execute.")
 
     # ---------------- Expression evaluation ----------------
     def get_var(self, var_num: int) -> float:
         if var_num == -1: return self.machine_pos['X']
         if var_num == -2: return self.machine_pos['Y']
         if var_num == -3: return self.machine_pos['Z']
-        return float(self.vars.get(var_num, 0.0))
+        if 0 <= var_num < len(self.vars):
+            return self.vars[var_num]
+        return self._sparse_vars.get(var_num, 0.0)
 
     def set_var(self, var_num: int, value: Number):
-        self.vars[var_num] = float(value)
+        # System variables (negative) go to the sparse dict, never the list
+        if 0 <= var_num < len(self.vars):
+            self.vars[var_num] = float(value)
+        else:
+            self._sparse_vars[var_num] = float(value)
+
+    def _tokenize_expr(self, expr: str) -> List[Tuple[Tag, object]]:
+        """
+        Single left-to-right scan into typed tokens. Variables are resolved
+        to their number here, so later stages never look at names again.
+        """
+        tokens: List[Tuple[Tag, object]] = []
+        digits = self._digits
+        single = self._single_tokens
+        n = len(expr)
+        i = 0
+        while i < n:
+            ch = expr[i]
+
+            if ch.isspace():
+                i += 1
+
+            # number: 12 or 12.5
+            elif ch in digits:
+                j = i + 1
+                while j < n and expr[j] in digits:
+                    j += 1
+                if j + 1 < n and expr[j] == "." and expr[j + 1] in digits:
+                    j += 2
+                    while j < n and expr[j] in digits:
+                        j += 1
+                tokens.append((Tag.NUM, float(expr[i:j])))
+                i = j
+
+            elif ch in single:
+                tokens.append(single[ch])
+                i += 1
+
+            # variable: #100, #Counter or #robot0.HOME_Z
+            elif ch == "#" and i + 1 < n and (expr[i + 1] in self._ident_start or expr[i + 1] in digits):
+                j = i + 2
+                if expr[i + 1] in digits:
+                    while j < n and expr[j] in digits:
+                        j += 1
+                else:
+                    while j < n and (expr[j].isalnum() or expr[j] in "_."):
+                        j += 1
+                tokens.append((Tag.VAR, self._resolve_var(expr[i:j])))
+                i = j
+
+            # MOD as a whole word
+            elif (expr[i:i + 3].upper() == "MOD"
+                    and (i == 0 or not (expr[i - 1].isalnum() or expr[i - 1] == "_"))
+                    and (i + 3 == n or not (expr[i + 3].isalnum() or expr[i + 3] == "_"))):
+                tokens.append((Tag.OP, "MOD"))
+                i += 3
+
+            else:
+                tokens.append((Tag.BAD, ch))
+                i += 1
 
-    def _tokenize_expr(self, expr: str) -> List[str]:
-        tokens: List[str] = []
-        for m in self._re_token.finditer(expr):
-            t = m.group(1)
-            if not t:
-                continue
-            t = t.strip()
-            if not t:
-                continue
-            tokens.append(t)
         return tokens
 
-    def _to_rpn(self, tokens: List[str]) -> List[str]:
+    def _to_rpn(self, tokens: List[Tuple[Tag, object]]) -> List[Tuple[Tag, object]]:
         """
         Shunting-yard to convert to Reverse Polish Notation.
         Supports + - * / MOD and parentheses.
         """
-        out: List[str] = []
-        stack: List[str] = []
+        out: List[Tuple[Tag, object]] = []
+        stack: List[Tuple[Tag, object]] = []
 
         prec = {
             "MOD": 2,
@@ -354,99 +832,117 @@ class MacroRunner(QObject):
             "-": 1,
         }
 
-        def is_op(tok: str) -> bool:
-            return tok.upper() in prec
-
         for tok in tokens:
-            up = tok.upper()
+            tag = tok[0]
 
-            # variable (named or numbered)
-            if tok.startswith("#"):
-                out.append(tok)
-                continue
-            
-            # number (restore removed check)
-            if re.match(r"^\d+(\.\d*)?$", tok) or re.match(r"^\.\d+$", tok):
+            # number or variable
+            if tag == Tag.NUM or tag == Tag.VAR:
                 out.append(tok)
                 continue
 
-            if up == "(":
-                stack.append(up)
+            if tag == Tag.LPAREN:
+                stack.append(tok)
                 continue
-            if up == ")":
-                while stack and stack[-1] != "(":
+            if tag == Tag.RPAREN:
+                while stack and stack[-1][0] != Tag.LPAREN:
                     out.append(stack.pop())
-                if stack and stack[-1] == "(":
+                if stack:
                     stack.pop()
                 else:
                     raise ValueError("Mismatched parentheses")
                 continue
 
-            if is_op(up):
-                while stack and stack[-1] in prec and prec[stack[-1]] >= prec[up]:
+            if tag == Tag.OP:
+                p = prec[tok[1]]
+                while stack and stack[-1][0] == Tag.OP and prec[stack[-1][1]] >= p:
                     out.append(stack.pop())
-                stack.append(up)
+                stack.append(tok)
                 continue
 
             # Unknown token => error
-            raise ValueError(f"Unknown token in expression: '{tok}'")
+            raise ValueError(f"Unknown token in expression: '{tok[1]}'")
 
         while stack:
-            op = stack.pop()
-            if op in ("(", ")"):
+            tok = stack.pop()
+            if tok[0] == Tag.LPAREN:
                 raise ValueError("Mismatched parentheses")
-            out.append(op)
+            out.append(tok)
 
         return out
 
-    def eval_arith(self, expr: str) -> float:
+    def compile_arith(self, expr: str) -> Callable[[], float]:
+        """
+        Tokenize + shunting-yard once and compile the RPN to a Python
+        function; evaluating the expression is then a single call.
+        """
+        return self._src_to_fn(self._compile_arith_src(expr)[0])
+
+    def _compile_arith_src(self, expr: str) -> Tuple[str, Optional[float]]:
         tokens = self._tokenize_expr(expr)
-        # Handle unary minus by inserting 0 before leading '-' or after '('
-        fixed: List[str] = []
-        prev = None
-        for t in tokens:
-            if t == "-" and (prev is None or prev in ("(", "+", "-", "*", "/", "MOD")):
-                fixed.extend(["0", "-"])
-            else:
-                fixed.append(t)
-            prev = t.upper() if isinstance(t, str) else t
+        # Handle unary minus by inserting 0 before leading '-' or after '(' / an operator
+        fixed: List[Tuple[Tag, object]] = []
+        prev_tag = None
+        for tok in tokens:
+            if tok == (Tag.OP, "-") and (prev_tag is None or prev_tag == Tag.LPAREN or prev_tag == Tag.OP):
+                fixed.append((Tag.NUM, 0.0))
+            fixed.append(tok)
+            prev_tag = tok[0]
 
-        rpn = self._to_rpn(fixed)
-        st: List[float] = []
+        return self._rpn_to_src(self._to_rpn(fixed))
 
-        for tok in rpn:
-            up = tok.upper()
-            
-            # Variable resolution (numbered or named)
-            if tok.startswith("#"):
-                var_num = self._resolve_var(tok)
-                st.append(self.get_var(var_num))
-            
-            # Number
-            elif re.match(r"^\d+(\.\d*)?$", tok) or re.match(r"^\.\d+$", tok):
-                st.append(float(tok))
-                
-            elif up in ("+", "-", "*", "/", "MOD"):
+    def _rpn_to_src(self, rpn: List[Tuple[Tag, object]]) -> Tuple[str, Optional[float]]:
+        """
+        Fold RPN into a fully parenthesized Python expression over floats,
+        e.g. "#100 + 1" -> "(v[100] + 1.0)". Returns (source, value), value
+        being the float when the whole expression is constant, else None.
+        Only numbers, v[] / get() lookups and + - * / % are ever emitted; operators
+        whose operands are both numbers are computed here instead.
+        """
+        # Stack items: (source, value) - value is the float for constants, else None
+        st: List[Tuple[str, Optional[float]]] = []
+
+        for tag, value in rpn:
+            if tag == Tag.VAR:
+                if 0 <= value < len(self.vars):
+                    st.append((f"v[{value}]", None))
+                else:
+                    # System (negative) and sparse high-numbered variables
+                    st.append((f"get({value})", None))
+            elif tag == Tag.NUM:
+                st.append((self._num_src(value), value))
+            elif tag == Tag.OP:
                 if len(st) < 2:
                     raise ValueError("Bad expression stack")
-                b = st.pop()
-                a = st.pop()
-                if up == "+":
-                    st.append(a + b)
-                elif up == "-":
-                    st.append(a - b)
-                elif up == "*":
-                    st.append(a * b)
-                elif up == "/":
-                    st.append(a / b)
-                elif up == "MOD":
-                    st.append(a % b)
+                b_src, b = st.pop()
+                a_src, a = st.pop()
+                if a is not None and b is not None:
+                    v = self._arith_fns[value](a, b)
+                    st.append((self._num_src(v), v))
+                else:
+                    st.append((f"({a_src} {self._arith_ops[value]} {b_src})", None))
             else:
-                raise ValueError(f"Bad RPN token: {tok}")
+                raise ValueError(f"Bad RPN token: {value}")
 
         if len(st) != 1:
             raise ValueError("Bad expression result")
-        return float(st[0])
+        return st[0]
+
+    def _src_to_fn(self, src: str) -> Callable[[], float]:
+        return eval(f"lambda: float({src})", self._expr_ns)
+
+    @staticmethod
+    def _num_src(value: float) -> str:
+        # inf/nan have no literal form
+        return repr(value) if math.isfinite(value) else f"float('{value!r}')"
+
+    def eval_arith(self, expr: str) -> float:
+        return self.eval_compiled(self.compile_arith(expr))
+
+    @staticmethod
+    def eval_compiled(fn: Callable[[], Number]) -> Number:
+        if isinstance(fn, Exception):  # compile error kept by _try_compile
+            raise fn
+        return fn()
 
     def eval_condition(self, cond: str) -> bool:
         """
@@ -457,36 +953,48 @@ class MacroRunner(QObject):
           "#100 LE 2"
           "[#100 GE 1] AND [#101 LT 3]"  (outer brackets already stripped by IF parser)
         """
+        return self.eval_compiled(self.compile_condition(cond))
+
+    def compile_condition(self, cond: str) -> Callable[[], bool]:
+        """
+        Compile a condition into one Python function: comparisons joined
+        with and/or (which short-circuit), e.g. "#100 LE 2 AND #101 GT 0" ->
+        lambda: bool(((v[100] <= 2.0) and (v[101] > 0.0))).
+        A comparison that fails to compile keeps its exception so it only
+        raises if evaluated.
+        """
         # Normalize spaces
-        c = re.sub(r"\s+", " ", cond.strip())
+        c = self._re_spaces.sub(" ", cond.strip())
 
+        errs: List[Exception] = []
         # Split OR first
-        or_parts = re.split(r"\bOR\b", c, flags=re.IGNORECASE)
-        or_results: List[bool] = []
-        for part in or_parts:
+        or_srcs: List[str] = []
+        for part in self._re_or.split(c):
             part = part.strip()
             if not part:
                 continue
-            and_parts = re.split(r"\bAND\b", part, flags=re.IGNORECASE)
-            and_ok = True
-            for ap in and_parts:
+            and_srcs: List[str] = []
+            for ap in self._re_and.split(part):
                 ap = ap.strip()
                 if not ap:
                     continue
-                and_ok = and_ok and self._eval_simple_comparison(ap)
-                if not and_ok:
-                    break
-            or_results.append(and_ok)
+                try:
+                    and_srcs.append(self._compile_simple_comparison(ap))
+                except Exception as e:
+                    and_srcs.append(f"fail(errs[{len(errs)}])")
+                    errs.append(e)
+            or_srcs.append("(" + " and ".join(and_srcs) + ")" if and_srcs else "True")
 
-        return any(or_results) if or_results else False
+        src = " or ".join(or_srcs) if or_srcs else "False"
+        return eval(f"lambda errs=errs: bool({src})", self._expr_ns, {"errs": errs})
 
-    def _eval_simple_comparison(self, text: str) -> bool:
+    def _compile_simple_comparison(self, text: str) -> str:
         """
         Supports:
         EQ NE GT GE LT LE
         <  >  <=  >=
         """
-        t = re.sub(r"\s+", " ", text.strip())
+        t = self._re_spaces.sub(" ", text.strip())
 
         # Normalize symbolic operators to word operators
         replacements = {
@@ -504,7 +1012,7 @@ class MacroRunner(QObject):
         # Find operator
         op_found = None
         for op in self._cond_ops:
-            if re.search(rf"\b{op}\b", t, flags=re.IGNORECASE):
+            if self._cond_op_res[op].search(t):
                 op_found = op
                 break
 
@@ -513,227 +1021,194 @@ class MacroRunner(QObject):
                 f"Condition missing operator (EQ/NE/GT/GE/LT/LE): '{text}'"
             )
 
-        left, right = re.split(
-            rf"\b{op_found}\b", t, maxsplit=1, flags=re.IGNORECASE
-        )
+        left, right = self._cond_op_res[op_found].split(t, maxsplit=1)
+        left_src, _ = self._compile_arith_src(left.strip())
+        right_src, _ = self._compile_arith_src(right.strip())
 
-        a = self.eval_arith(left.strip())
-        b = self.eval_arith(right.strip())
-
-        if op_found == "EQ":
-            return a == b
-        if op_found == "NE":
-            return a != b
-        if op_found == "GT":
-            return a > b
-        if op_found == "GE":
-            return a >= b
-        if op_found == "LT":
-            return a < b
-        if op_found == "LE":
-            return a <= b
-
-        raise ValueError(f"Unknown operator: {op_found}")
+        return f"({left_src} {self._cond_syms[op_found]} {right_src})"
 
     # ---------------- Main runner ----------------
-    def run_current_line(self):
-        if not self.is_running:
+    def run_current_line(self) -> Optional[str]:
+        """
+        Execute the line at current_index.
+        Returns the command to send to the controller, or None if the line
+        was handled locally (index/scope already advanced).
+        """
+        if self.state == IDLE:
             return
-        if self.current_index >= len(self.lines):
+        if self.current_index >= self.line_count:
             self.stop_macro()
             return
 
-        raw_line = self.lines[self.current_index]
-        line = self.preprocess_line(raw_line)
+        self._emit_line()
+        return self.actions[self.current_index]()
 
-        # UI update even for blanks
-        self.current_line_changed.emit(self.current_index)
+    def _skip_line(self) -> None:
+        self._advance(self.current_index + 1, self.current_scope)
 
-        if not line:
+    def _op_skip_sub(self, sub_name: int):
+        # Fix: If we hit an O-line, it means we 'fell through' to it (since M98 jumps to body).
+        # We should skip the entire block.
+        if sub_name in self.subprograms:
+            _, _, end_idx = self.subprograms[sub_name]
+            self._log(f"Skipping subprogram O{sub_name} definition.")
+            self._advance(end_idx + 1, self.current_scope)
+        else:
+            # Should not happen if parse_script works, but safety fallback
             self._advance(self.current_index + 1, self.current_scope)
+
+    def _op_assign(self, var_num: int, expr: Callable[[], float]):
+        # Assignment: #100 = expr  (LOCAL)
+        try:
+            val = self.eval_compiled(expr)
+            self.set_var(var_num, val)
+            self._log(f"Set #{var_num} = {val:g}")
+        except Exception as e:
+            self._log(f"Assignment error at line {self.current_index}: {e}")
+            self.stop_macro()
             return
 
-        u = line.upper()
+        self._advance(self.current_index + 1, self.current_scope)
 
-        # Split leading N (keep for label map, but execution uses 'rest')
-        _n, rest = self.split_leading_n(line)
-        u_rest = rest.upper()
+    def _eval_if(self, cond: Callable[[], bool]) -> Optional[bool]:
+        """
+        IF [cond] (LOCAL EVAL). Returns None (macro stopped) on error.
+        """
+        try:
+            return self.eval_compiled(cond)
+        except Exception as e:
+            self._log(f"IF parse/eval error at line {self.current_index}: {e}")
+            self.stop_macro()
+            return None
 
-        # 0) Subprogram header O####
-        # Fix: If we hit an O-line, it means we 'fell through' to it (since M98 jumps to body).
-        # We should skip the entire block.
-        m_o = self._re_o_sub.match(u_rest)
-        if m_o:
-            sub_name = int(m_o.group(1))
-            if sub_name in self.subprograms:
-                _, _, end_idx = self.subprograms[sub_name]
-                self.log_message.emit(f"Skipping subprogram O{sub_name} definition.")
-                self._advance(end_idx + 1, self.current_scope)
-            else:
-                # Should not happen if parse_script works, but safety fallback
-                self._advance(self.current_index + 1, self.current_scope)
+    def _op_if_goto(self, cond: Callable[[], bool], target_n: int, dest: int, dest_scope: str):
+        ok = self._eval_if(cond)
+        if ok is None:
             return
-
-        # 1) Assignment: #100 = expr  (LOCAL)
-        m_as = self._re_assign.match(u_rest)
-        if m_as:
-            var_token = "#" + m_as.group(1)
-            var_num = self._resolve_var(var_token)
-            expr = m_as.group(2)
-            try:
-                val = self.eval_arith(expr)
-                self.set_var(var_num, val)
-                self.log_message.emit(f"Set #{var_num} = {val:g}")
-            except Exception as e:
-                self.log_message.emit(f"Assignment error at line {self.current_index}: {e}")
-                self.stop_macro()
-                return
-
+        if not ok:
+            # IF false -> just go next line
             self._advance(self.current_index + 1, self.current_scope)
             return
 
-        # 2) IF [cond] THEN action  (LOCAL EVAL)
-        m_if = self._re_if_then.match(u_rest)
-        if m_if:
-            cond = m_if.group(1).strip()
-            action = m_if.group(2).strip()
-
-            try:
-                ok = self.eval_condition(cond)
-            except Exception as e:
-                self.log_message.emit(f"IF parse/eval error at line {self.current_index}: {e}")
-                self.stop_macro()
-                return
-
-            if ok:
-                # Support THEN GOTO N  (LOCAL JUMP)
-                m_g = self._re_uncond_goto.match(action)
-                if m_g:
-                    target_n = int(m_g.group(1))
-
-                    # Jump preference: MAIN labels if we're in MAIN loop
-                    # For your loop example, it must jump inside MAIN.
-                    main_map = self.label_maps.get("MAIN", {})
-                    if target_n in main_map:
-                        target_idx = main_map[target_n]
-                        self.log_message.emit(f"IF true -> GOTO N{target_n} (MAIN)")
-                        self._advance(target_idx, "MAIN")
-                        return
-
-                    # fallback current scope labels
-                    scope_map = self.label_maps.get(self.current_scope, {})
-                    if target_n in scope_map:
-                        target_idx = scope_map[target_n]
-                        self.log_message.emit(f"IF true -> GOTO N{target_n} ({self.current_scope})")
-                        self._advance(target_idx, self.current_scope)
-                        return
-
-                    self.log_message.emit(f"IF GOTO Error: Label N{target_n} not found!")
-                    self.stop_macro()
-                    return
+        # Destination pre-resolved by parse_script: MAIN labels first (the
+        # usual loop-in-MAIN case), then the labels of the line's own scope.
+        if dest < 0:
+            self._log(f"IF GOTO Error: Label N{target_n} not found!")
+            self.stop_macro()
+            return
+        self._log(f"IF true -> GOTO N{target_n} ({dest_scope})")
+        self._advance(dest, dest_scope)
 
-                # If action not supported locally, you can either:
-                # - send to controller, OR
-                # - treat as error
-                self.log_message.emit(f"IF action not supported locally: '{action}'")
-                self.stop_macro()
-                return
-            else:
-                # IF false -> just go next line
-                self._advance(self.current_index + 1, self.current_scope)
-                return
+    def _op_if_other(self, cond: Callable[[], bool], action: str):
+        ok = self._eval_if(cond)
+        if ok is None:
+            return
+        if not ok:
+            self._advance(self.current_index + 1, self.current_scope)
+            return
 
-        # 3) M98 call (LOCAL)
-        m98 = self._re_m98.match(u_rest)
-        if m98:
-            sub_name = int(m98.group(1))
-            repeat = int(m98.group(2)) if m98.group(2) else 1
-            if repeat <= 0:
-                repeat = 1
+        # If action not supported locally, you can either:
+        # - send to controller, OR
+        # - treat as error
+        self._log(f"IF action not supported locally: '{action}'")
+        self.stop_macro()
 
-            if sub_name not in self.subprograms:
-                self.log_message.emit(f"Call Error: O{sub_name} not found for '{rest}'")
-                self.stop_macro()
-                return
+    def _op_m98(self, sub_name: int, repeat: int, rest: str):
+        # M98 call (LOCAL)
+        if sub_name not in self.subprograms:
+            self._log(f"Call Error: O{sub_name} not found for '{rest}'")
+            self.stop_macro()
+            return
 
-            _, first_exec, _end_idx = self.subprograms[sub_name]
+        _, first_exec, _end_idx = self.subprograms[sub_name]
 
-            self.call_stack.append(
-                CallFrame(
-                    return_index=self.current_index + 1,
-                    return_scope=self.current_scope,
-                    sub_name=sub_name,
-                    repeat_left=repeat,
-                    sub_first_exec_index=first_exec,
-                )
+        self.call_stack.append(
+            CallFrame(
+                return_index=self.current_index + 1,
+                return_scope=self.current_scope,
+                sub_name=sub_name,
+                repeat_left=repeat,
+                sub_first_exec_index=first_exec,
             )
+        )
 
-            self.log_message.emit(f"Calling subprogram O{sub_name} (x{repeat})")
-            self._advance(first_exec, f"O{sub_name}")
-            return
-
-        # 4) M99 return (LOCAL)
-        if self._re_m99.match(u_rest):
-            if not self.call_stack:
-                self.log_message.emit("M99 encountered with empty call stack. Stopping.")
-                self.stop_macro()
-                return
-
-            frame = self.call_stack[-1]
-            if frame.repeat_left > 1:
-                frame.repeat_left -= 1
-                self.call_stack[-1] = frame
-                self.log_message.emit(f"Repeating O{frame.sub_name} (remaining {frame.repeat_left})")
-                self._advance(frame.sub_first_exec_index, f"O{frame.sub_name}")
-                return
+        self._log(f"Calling subprogram O{sub_name} (x{repeat})")
+        self._advance(first_exec, f"O{sub_name}")
 
-            self.call_stack.pop()
-            self.log_message.emit(f"Return from O{frame.sub_name}")
-            self._advance(frame.return_index, frame.return_scope)
+    def _op_m99(self):
+        # M99 return (LOCAL)
+        if not self.call_stack:
+            self._log("M99 encountered with empty call stack. Stopping.")
+            self.stop_macro()
             return
 
-        # 5) Unconditional GOTO N (LOCAL)
-        mg = self._re_uncond_goto.match(u_rest)
-        if mg:
-            target_n = int(mg.group(1))
-            # Prefer current scope then MAIN
-            scope_map = self.label_maps.get(self.current_scope, {})
-            if target_n in scope_map:
-                self.log_message.emit(f"GOTO N{target_n} ({self.current_scope})")
-                self._advance(scope_map[target_n], self.current_scope)
-                return
-            main_map = self.label_maps.get("MAIN", {})
-            if target_n in main_map:
-                self.log_message.emit(f"GOTO N{target_n} (MAIN)")
-                self._advance(main_map[target_n], "MAIN")
-                return
-
-            self.log_message.emit(f"GOTO Error: Label N{target_n} not found!")
-            self.stop_macro()
+        frame = self.call_stack[-1]
+        if frame.repeat_left > 1:
+            frame.repeat_left -= 1
+            self._log(f"Repeating O{frame.sub_name} (remaining {frame.repeat_left})")
+            self._advance(frame.sub_first_exec_index, f"O{frame.sub_name}")
             return
 
-        # 6) Otherwise: send to controller and wait ok
+        self.call_stack.pop()
+        self._log(f"Return from O{frame.sub_name}")
+        self._advance(frame.return_index, frame.return_scope)
+
+    def _build_command(self, rest: str, parts: Optional[List[object]]) -> Optional[str]:
+        """
+        Final controller command for a line: [expr] substitution + feed override.
+        parts is the template from _compile_send (None: nothing to substitute).
+        """
         # Fix: Substitute variables first! e.g. G01 Z[#100 + 10] -> G01 Z110
         try:
-            final_cmd = self.substitute_vars(rest)
-            
+            if parts is None:
+                final_cmd = rest
+            else:
+                final_cmd = "".join([
+                    p if isinstance(p, str) else f"{self.eval_compiled(p):g}"
+                    for p in parts
+                ])
+
+
             # Apply Speed Override to Feed Rate (F)
             if self.speed_override != 1.0:
-                # Regex to find F<val>, e.g. F1000 or F 1000
-                # We use a replacer function to scale the value
-                def f_replacer(match):
-                    prefix = match.group(1) # F
-                    val = float(match.group(2))
-                    new_val = val * self.speed_override
-                    return f"{prefix}{new_val:.2f}"
-                
-                final_cmd = re.sub(r"([Ff])\s*(\d+(?:\.\d+)?)", f_replacer, final_cmd)
-
-            self._send_and_wait_ok(final_cmd)
+                if parts is not None:
+                    return self._apply_feed_override(final_cmd)
+                # Static line: scale once per override factor
+                if self._feed_cache_factor != self.speed_override:
+                    self._feed_cache.clear()
+                    self._feed_cache_factor = self.speed_override
+                cached = self._feed_cache.get(rest)
+                if cached is None:
+                    cached = self._feed_cache[rest] = self._apply_feed_override(rest)
+                return cached
+
+            return final_cmd
         except Exception as e:
-            self.log_message.emit(f"Substitution/Eval Error at line {self.current_index}: {e}")
+            self._log(f"Substitution/Eval Error at line {self.current_index}: {e}")
+            self.stop_macro()
+            return None
+
+    def _apply_feed_override(self, cmd: str) -> str:
+        # Regex to find F<val>, e.g. F1000 or F 1000
+        # We use a replacer function to scale the value
+        def f_replacer(match):
+            prefix = match.group(1) # F
+            val = float(match.group(2))
+            new_val = val * self.speed_override
+            return f"{prefix}{new_val:.2f}"
+
+        return self._re_feed.sub(f_replacer, cmd)
+
+    def _goto(self, target_n: int, dest: int, dest_scope: str):
+        """
+        Unconditional GOTO N (LOCAL), destination pre-resolved by parse_script.
+        """
+        if dest < 0:
+            self._log(f"GOTO Error: Label N{target_n} not found!")
             self.stop_macro()
             return
+        self._log(f"GOTO N{target_n} ({dest_scope})")
+        self._advance(dest, dest_scope)
 
     def substitute_vars(self, line: str) -> str:
         """
@@ -742,9 +1217,6 @@ class MacroRunner(QObject):
         However, pure #100 replacement might be useful too.
         Let's stick to [] for now as per user request: Z[#robot0.HOME_Z - 80]
         """
-        # Regex to find [...]
-        pattern = re.compile(r"\[(.*?)\]")
-        
         def replacer(match):
             expr = match.group(1)
             val = self.eval_arith(expr)
@@ -752,31 +1224,27 @@ class MacroRunner(QObject):
             # %g removes trailing zeros
             return f"{val:g}"
 
-        return pattern.sub(replacer, line)
+        return self._re_bracket_expr.sub(replacer, line)
 
     # ---------------- Serial RX ----------------
-    def on_serial_rx(self, message: str):
-        print(message)
-        if not self.is_running or not self.waiting_for_ok:
+    def on_serial_rx_ok(self):
+        """
+        One 'ok' from the controller (classified by SerialWorker off the GUI thread).
+        """
+        if self.state != WAIT:
             return
-        
-        if "ok" in (message or "").lower():
-            self.waiting_for_ok = False
-            self.watchdog.stop()
-
-            self.current_index += 1
-            if self.current_index >= len(self.lines):
-                self.stop_macro()
-                return
-
-            if self.debug_mode:
-                self.log_message.emit(f"Debug: Line finished. Next line: {self.current_index}")
-                self.current_line_changed.emit(self.current_index)
-                return
+        self._inflight -= 1
+        if not self._inflight:
+            self.state = RUN
+        self._cmd_sent_ns = time.monotonic_ns()
+        self._ok_event.set()
 
-            QTimer.singleShot(0, self.run_current_line)
+    def _check_timeout(self):
+        if (self.state == WAIT
+                and time.monotonic_ns() - self._cmd_sent_ns > self.watchdog_timeout_ms * 1_000_000):
+            self.on_watchdog_timeout()
 
     def on_watchdog_timeout(self):
-        if self.is_running and self.waiting_for_ok:
-            self.log_message.emit("Timeout requesting 'ok' response. Stopping macro.")
+        if self.state == WAIT:
+            self._log("Timeout requesting 'ok' response. Stopping macro.")
             self.stop_macro()
@@ -0,0 +1,18 @@
+import serial.tools.list_ports
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+
+class PortScanSignals(QObject):
+    result = pyqtSignal(list) # Device names, e.g. ['COM3', '/dev/ttyUSB0']
+
+class PortScanTask(QRunnable):
+    """
+    Enumerates serial ports on a QThreadPool thread; comports() can block
+    for hundreds of ms on Windows.
+    """
+    def __init__(self):
+        super().__init__()
+        self.signals = PortScanSignals()
+
+    def run(self):
+        devices = [port.device for port in serial.tools.list_ports.comports()]
+        self.signals.result.emit(devices)
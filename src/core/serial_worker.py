@@ -1,11 +1,20 @@
+import logging
+import re
 import serial
 from PyQt5.QtCore import QThread, pyqtSignal
 
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
 class SerialWorker(QThread):
     data_received = pyqtSignal(str)
+    ok_received = pyqtSignal() # Controller acknowledged one command
     error_occurred = pyqtSignal(str)
     connected_status = pyqtSignal(bool)
 
+    # Controller acknowledgement: whole-word "ok" (not "look"/"broken"/"LookingOk")
+    _re_ok = re.compile(r"\bok\b", re.IGNORECASE)
+
     def __init__(self):
         super().__init__()
         self.serial_port = None
@@ -30,20 +39,37 @@ class SerialWorker(QThread):
     def run(self):
         try:
             self.serial_port = serial.Serial(self.port_name, self.baud_rate, timeout=0.1)
+            # Windows only: enlarge the driver ring buffers so bursts of
+            # telemetry at 115200 baud do not overflow between reads
+            if hasattr(self.serial_port, "set_buffer_size"):
+                try:
+                    self.serial_port.set_buffer_size(rx_size=16384, tx_size=4096)
+                except serial.SerialException:
+                    pass
             self.is_running = True
             self.connected_status.emit(True)
             
+            # Drain whatever is waiting in one read; read(1) blocks for up to
+            # the port timeout when idle, so no sleep/poll is needed.
+            buf = bytearray()
             while self.is_running and self.serial_port.is_open:
-                if self.serial_port.in_waiting > 0:
-                    try:
-                        line = self.serial_port.readline().decode('utf-8').strip()
-                        if line:
-                            self.data_received.emit(line)
-                    except UnicodeDecodeError:
-                        pass # Ignore decode errors
-                else:
-                    self.msleep(10) # Prevent CPU hogging
-                    
+                data = self.serial_port.read(self.serial_port.in_waiting or 1)
+                if not data:
+                    # Port timed out: hand over an unterminated reply like
+                    # readline() did, instead of holding it forever
+                    if buf:
+                        raw = bytes(buf)
+                        buf.clear()
+                        self._handle_line(raw)
+                    continue
+                buf += data
+                nl = buf.find(b'\n')
+                while nl >= 0:
+                    raw = bytes(buf[:nl])
+                    del buf[:nl + 1]
+                    self._handle_line(raw)
+                    nl = buf.find(b'\n')
+
         except serial.SerialException as e:
             self.error_occurred.emit(str(e))
             self.connected_status.emit(False)
@@ -51,12 +77,29 @@ class SerialWorker(QThread):
             self.error_occurred.emit(f"Unexpected Error: {e}")
             self.connected_status.emit(False)
 
+    def _handle_line(self, raw):
+        try:
+            line = raw.decode('utf-8').strip()
+        except UnicodeDecodeError:
+            return # Ignore decode errors
+        if line:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("rx %r", line)
+            # Classify here so the GUI thread only gets a bare 'ok' event.
+            # Most acks are the whole line, so try the exact compare first.
+            if line == "ok" or self._re_ok.search(line):
+                self.ok_received.emit()
+            self.data_received.emit(line)
+
     def write_data(self, data):
         if self.serial_port and self.serial_port.is_open:
             try:
-                if not data.endswith('\n'):
-                    data += '\n'
-                self.serial_port.write(data.encode('utf-8'))
+                if isinstance(data, str):
+                    if not data.endswith('\n'):
+                        data += '\n'
+                    data = data.encode('utf-8')
+                # bytes are written as given (already newline-terminated)
+                self.serial_port.write(data)
                 return True
             except Exception as e:
                 self.error_occurred.emit(f"Write Error: {e}")
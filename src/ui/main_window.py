@@ -1,24 +1,45 @@
-import serial.tools.list_ports
 import time
 import re
+from collections import deque
+from functools import partial
 from PyQt5.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                              QGridLayout, QPushButton, QLabel, QComboBox, 
-                             QTextEdit, QLineEdit, QGroupBox, QRadioButton, 
+                             QTextEdit, QPlainTextEdit, QLineEdit, QGroupBox, QRadioButton, 
                              QButtonGroup, QSlider, QSplitter, QMessageBox, 
                              QFrame, QApplication)
-from PyQt5.QtCore import Qt, QTimer
-from PyQt5.QtGui import QTextCursor, QTextBlockFormat, QColor, QTextCharFormat
+from PyQt5.QtCore import Qt, QEvent, QTimer, QThreadPool, pyqtSlot
+from PyQt5.QtGui import QTextCursor, QTextBlockFormat, QColor, QTextFormat
 from src.core.serial_worker import SerialWorker
 from src.core.macro_runner import MacroRunner
-from src.ui.styles import DARK_THEME_QSS
+from src.core.port_scanner import PortScanTask
+from src.ui.styles import QSS_FRAGMENTS
+from src.ui.signal_proxy import SignalProxy
 
 class CNCWindow(QMainWindow):
+    # Jog move per axis, formatted with the absolute target position
+    JOG_TEMPLATES = {'X': "G01 X{:.3f}", 'Y': "G01 Y{:.3f}", 'Z': "G01 Z{:.3f}"}
+    # Jog pad layout: (label, axis, direction, grid row, grid column)
+    JOG_BUTTONS = (
+        ("Y+", 'Y', 1, 0, 1), ("Y-", 'Y', -1, 2, 1),
+        ("X-", 'X', -1, 1, 0), ("X+", 'X', 1, 1, 2),
+        ("Z+", 'Z', 1, 0, 3), ("Z-", 'Z', -1, 1, 3),
+    )
+    # Jog step selector: combo text -> step size (mm)
+    STEP_SIZES = {"0.01": 0.01, "0.1": 0.1, "1": 1, "5": 5, "10": 10, "100": 100, "200": 200}
+    # Queued macro commands are written early once this many bytes are pending
+    TX_FLUSH_BYTES = 2048
+
+    # RX parsing (compiled once, used for every received line)
+    _re_pos_csv = re.compile(r"([+-]?\d+(?:\.\d+)?),([+-]?\d+(?:\.\d+)?),([+-]?\d+(?:\.\d+)?)")
+    _re_grbl_pos = re.compile(r"(?:MPos|WPos):([-\d\.]+),([-\d\.]+),([-\d\.]+)")
+    _re_motion_param = re.compile(r"([FAJSE])[:\s]*(\d+(?:\.\d+)?)", re.IGNORECASE)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("DELTA X - ULTRA CONTROLLER")
         self.resize(1000, 700)
-        self.setStyleSheet(DARK_THEME_QSS)
         self.toggle_mode_checked = True
+        self.text_terminal = None # Created by _build_right_panel; log() queues until then
         # State vars
         self.serial_worker = SerialWorker()
         self.macro_runner = MacroRunner()
@@ -26,36 +47,74 @@ class CNCWindow(QMainWindow):
         self.feed_rate = 1000
 
         # Signals - Serial
-        self.serial_worker.data_received.connect(self.on_serial_data)
+        # RX lines reach the UI in batches (<= 200 per second); the macro
+        # handshake uses ok_received below and is not rate limited.
+        self.rx_proxy = SignalProxy(self.serial_worker.data_received, rate_limit=200,
+                                    slot=self.on_serial_data_batch, parent=self)
         self.serial_worker.error_occurred.connect(self.on_serial_error)
         self.serial_worker.connected_status.connect(self.on_connection_status_changed)
         
         # Signals - Macro
-        self.macro_runner.command_to_send.connect(self.send_command)
+        self.macro_runner.command_to_send.connect(self.queue_command)
         self.macro_runner.log_message.connect(self.log)
         self.macro_runner.current_line_changed.connect(self.highlight_current_line)
         self.macro_runner.finished.connect(self.on_macro_finished)
         
-        # Connect Serial RX to Macro Runner for handshake
-        self.serial_worker.data_received.connect(self.macro_runner.on_serial_rx)
-
-        # Position Polling Timer
-        self.timer_position = QTimer()
+        # Connect Serial 'ok' events to Macro Runner for handshake
+        self.serial_worker.ok_received.connect(self.macro_runner.on_serial_rx_ok)
+
+        # Terminal log: lines are queued and written in one append per flush
+        self._ts_epoch = -1
+        self._ts_str = ""
+        self._log_buf = deque()
+        self._log_timer = QTimer(self)
+        self._log_timer.setSingleShot(True)
+        self._log_timer.setInterval(33) # ~30 Hz
+        self._log_timer.timeout.connect(self._flush_log)
+
+        # Macro TX queue: commands emitted in one event-loop pass go out in one write
+        self._tx_buf = []
+        self._tx_len = 0
+        self._tx_timer = QTimer(self)
+        self._tx_timer.setSingleShot(True)
+        self._tx_timer.setInterval(0)
+        self._tx_timer.timeout.connect(self._flush_tx)
+
+        # Macro line highlight, built once and re-pointed at each step
+        self._hl_selection = QTextEdit.ExtraSelection()
+        self._hl_selection.format.setBackground(QColor("#00695c")) # Teal Highlight
+        self._hl_selection.format.setProperty(QTextFormat.FullWidthSelection, True)
+
+        # Position Polling: one query in flight; the next is scheduled
+        # 200ms after its reply, or re-sent if no reply within 500ms
+        self._polling = False
+        self._pos_pending = False
+        self._last_pos = (None, None, None)
+        self._pos = {'X': 0.0, 'Y': 0.0, 'Z': 0.0} # Last reported position, used by jog
+        self.timer_position = QTimer(self)
+        self.timer_position.setSingleShot(True)
+        self.timer_position.setTimerType(Qt.PreciseTimer) # Steady poll cadence
         self.timer_position.setInterval(200) # 200ms
         self.timer_position.timeout.connect(self.request_position)
+        self._pos_watchdog = QTimer(self)
+        self._pos_watchdog.setSingleShot(True)
+        self._pos_watchdog.setInterval(500)
+        self._pos_watchdog.timeout.connect(self.request_position)
+
+        # Port refresh is debounced; repeated clicks collapse into one scan
+        self._last_ports = None
+        self._refresh_timer = QTimer(self)
+        self._refresh_timer.setSingleShot(True)
+        self._refresh_timer.setInterval(300)
+        self._refresh_timer.timeout.connect(self._do_refresh_ports)
 
         # UI Initialization
         self.init_ui()
-        self.refresh_ports()
+        self._do_refresh_ports()
 
         
         # Set Default Step Size triggers logic, so do it AFTER UI init
-        # Find the 1.0 button and check it
-        if hasattr(self, 'step_btn_group'):
-            for btn in self.step_btn_group.buttons():
-                if btn.text() == "1":
-                    btn.setChecked(True)
-                    break
+        self.combo_step.setCurrentText("1")
 
     def init_ui(self):
         central_widget = QWidget()
@@ -99,16 +158,13 @@ class CNCWindow(QMainWindow):
         left_main_layout.addWidget(col2_widget)
 
         # --- RIGHT PANEL (Terminal & Logic) ---
+        # Filled by _build_right_panel once the event loop is running,
+        # so the controls paint first
         right_panel = QWidget()
 
-        right_layout = QVBoxLayout(right_panel)
-        right_layout.setContentsMargins(0, 0, 0, 0)
-
-        # 1. Terminal Group
-        right_layout.addWidget(self.create_terminal_group(), stretch=3)
-
-        # 2. Macro Group
-        right_layout.addWidget(self.create_macro_group(), stretch=2)
+        self._right_layout = QVBoxLayout(right_panel)
+        self._right_layout.setContentsMargins(0, 0, 0, 0)
+        QTimer.singleShot(0, self._build_right_panel)
 
         # ADD TO SPLITTER OR LAYOUT directly
         splitter = QSplitter(Qt.Horizontal)
@@ -122,6 +178,18 @@ class CNCWindow(QMainWindow):
     # ------------------------------------------------------------------------
     # UI COMPONENT CREATION
     # ------------------------------------------------------------------------
+    @pyqtSlot()
+    def _build_right_panel(self):
+        # 1. Terminal Group
+        self._right_layout.addWidget(self.create_terminal_group(), stretch=3)
+
+        # 2. Macro Group
+        self._right_layout.addWidget(self.create_macro_group(), stretch=2)
+
+        # Show anything logged while the terminal did not exist yet
+        if self._log_buf:
+            self._log_timer.start()
+
     def create_connection_group(self):
         group = QGroupBox("Connection")
         layout = QGridLayout()
@@ -136,6 +204,7 @@ class CNCWindow(QMainWindow):
         self.combo_baud.setCurrentText("115200")
 
         self.btn_connect = QPushButton("CONNECT")
+        self.btn_connect.setObjectName("btn_connect")
         self.btn_connect.clicked.connect(self.toggle_connection)
         
         layout.addWidget(QLabel("Port:"), 0, 0)
@@ -155,10 +224,11 @@ class CNCWindow(QMainWindow):
         layout = QHBoxLayout()
         
         self.lbl_status = QLabel("DISCONNECTED")
-        self.lbl_status.setStyleSheet("color: #757575; font-weight: bold; font-size: 14px;")
+        self.lbl_status.setObjectName("lbl_status") # Styled by [state] in the dark theme
         
         self.btn_mode = QPushButton("AUTO JOB")
-        self.btn_mode.setStyleSheet("background-color: #00897b;")
+        self.btn_mode.setObjectName("btn_mode")
+        self.btn_mode.setProperty("state", "auto")
         self.btn_mode.setCheckable(True)
         self.btn_mode.setChecked(True)
         # self.btn_mode.setDisabled(True) # Removed disable
@@ -220,12 +290,14 @@ class CNCWindow(QMainWindow):
             if p == 5:
                 rbtn.setChecked(True)
             
-            # Connect
-            rbtn.toggled.connect(lambda checked, val=p: self.on_speed_changed(val) if checked else None)
-            
             layout.addWidget(rbtn)
-            self.speed_btn_group.addButton(rbtn)
-            
+            self.speed_btn_group.addButton(rbtn, p) # Button id = percentage
+
+        # One slot for the whole group
+        self.speed_btn_group.idToggled.connect(self._on_speed_toggled)
+        # The default check was set before the connect: sync the runner with it
+        self.macro_runner.set_speed_override(self.speed_btn_group.checkedId() / 100.0)
+
         group.setLayout(layout)
         return group
 
@@ -241,6 +313,7 @@ class CNCWindow(QMainWindow):
         
         # Labels map
         self.lbl_motion_vals = {}
+        self._last_motion_vals = {} # Key -> text currently shown
         params = [
             ("F", "Tốc độ trục 5 (u/s)"), 
             ("A", "Gia tốc trục 5 (u/s²)"), 
@@ -265,16 +338,8 @@ class CNCWindow(QMainWindow):
         # Button GET PARAMS
         self.btn_get_params = QPushButton("LẤY THÔNG SỐ (GET PARAMS)")
         self.btn_get_params.setCursor(Qt.PointingHandCursor)
-        self.btn_get_params.setStyleSheet("""
-            QPushButton {
-                background-color: #5c6bc0;
-                color: white;
-                font-weight: bold;
-                border-radius: 5px;
-                padding: 5px;
-            }
-            QPushButton:hover { background-color: #7986cb; }
-        """)
+        self.btn_get_params.setObjectName("btn_get_params")
+        self.btn_get_params.setStyleSheet(QSS_FRAGMENTS["btn_get_params"])
         self.btn_get_params.clicked.connect(self.request_motion_params)
         
         layout.addWidget(self.btn_get_params, 5, 0, 1, 2)
@@ -288,15 +353,12 @@ class CNCWindow(QMainWindow):
 
         # Step Size Selection
         step_layout = QHBoxLayout()
-        self.step_btn_group = QButtonGroup()
-        
-        steps = [0.01, 0.1, 1, 5, 10, 100, 200]
-        for val in steps:
-            rbtn = QRadioButton(str(val))
-            # Connect toggle but DON'T set Checked=True here within loop to avoid early firing before UI is ready
-            rbtn.toggled.connect(lambda checked, v=val: self.set_step(v) if checked else None)
-            step_layout.addWidget(rbtn)
-            self.step_btn_group.addButton(rbtn)
+        self.combo_step = QComboBox()
+        self.combo_step.addItems(self.STEP_SIZES.keys())
+        # Connect AFTER filling so the first item does not fire before UI is ready
+        self.combo_step.currentTextChanged.connect(self._on_step_text_changed)
+        step_layout.addWidget(QLabel("Step (mm):"))
+        step_layout.addWidget(self.combo_step, stretch=1)
         
         layout.addLayout(step_layout)
         
@@ -310,62 +372,38 @@ class CNCWindow(QMainWindow):
         grid = QGridLayout()
         grid.setSpacing(10)
         
-        btn_y_plus = QPushButton("Y+")
-        btn_y_plus.setProperty("class", "jog-btn")
-        btn_y_plus.clicked.connect(lambda: self.send_jog('Y', 1))
-        
-        btn_y_minus = QPushButton("Y-")
-        btn_y_minus.setProperty("class", "jog-btn")
-        btn_y_minus.clicked.connect(lambda: self.send_jog('Y', -1))
-
-        btn_x_minus = QPushButton("X-")
-        btn_x_minus.setProperty("class", "jog-btn")
-        btn_x_minus.clicked.connect(lambda: self.send_jog('X', -1))
-        
-        btn_x_plus = QPushButton("X+")
-        btn_x_plus.setProperty("class", "jog-btn")
-        btn_x_plus.clicked.connect(lambda: self.send_jog('X', 1))
-
-        btn_z_plus = QPushButton("Z+")
-        btn_z_plus.setProperty("class", "jog-btn")
-        btn_z_plus.clicked.connect(lambda: self.send_jog('Z', 1))
-        
-        btn_z_minus = QPushButton("Z-")
-        btn_z_minus.setProperty("class", "jog-btn")
-        btn_z_minus.clicked.connect(lambda: self.send_jog('Z', -1))
+        for text, axis, direction, row, col in self.JOG_BUTTONS:
+            btn = QPushButton(text)
+            btn.setProperty("jog", True) # Styled by [jog="true"] in the dark theme
+            btn.clicked.connect(partial(self.send_jog, axis, direction))
+            grid.addWidget(btn, row, col)
 
         btn_home = QPushButton("HOME (G28)")
         btn_home.setObjectName("btn_home")
         btn_home.clicked.connect(self.send_home)
-        
-        grid.addWidget(btn_y_plus, 0, 1)
-        grid.addWidget(btn_z_plus, 0, 3)
-        grid.addWidget(btn_x_minus, 1, 0)
         grid.addWidget(btn_home, 1, 1)
-        grid.addWidget(btn_x_plus, 1, 2)
-        grid.addWidget(btn_z_minus, 1, 3) 
-        grid.addWidget(btn_y_minus, 2, 1)
         
         layout.addLayout(grid)
         group.setLayout(layout)
         return group
 
+    @pyqtSlot()
     def toggle_mode(self):
         if not self.btn_mode.isChecked():
             self.btn_mode.setText("MANUAL JOB")
-            self.btn_mode.setStyleSheet("background-color: #34343d;")
+            self.set_style_state(self.btn_mode, "manual")
             self.log("Switched to MANUAL MODE")
             
             # Send M84 and Start Polling
-            self.send_command("M84 0A") 
-            self.timer_position.start()
+            self._send_trusted("M84 0A") 
+            self.start_polling()
         else:
             self.btn_mode.setText("AUTO JOB")
-            self.btn_mode.setStyleSheet("background-color: #00897b;") # Teal for Auto
+            self.set_style_state(self.btn_mode, "auto") # Teal for Auto
             self.log("Switched to AUTO MODE")
             
             # Stop Polling
-            self.timer_position.stop()
+            self.stop_polling()
 
     # Removed create_speed_group as requested
 
@@ -382,22 +420,7 @@ class CNCWindow(QMainWindow):
         self.btn_emg.clicked.connect(self.send_emg)
         self.btn_emg.setCursor(Qt.PointingHandCursor)
         self.btn_emg.setFixedHeight(60)
-        self.btn_emg.setStyleSheet("""
-            QPushButton {
-                background-color: #d32f2f;
-                color: white;
-                font-weight: bold;
-                font-size: 16px;
-                border: 2px solid #b71c1c;
-                border-radius: 8px;
-            }
-            QPushButton:hover {
-                background-color: #e53935;
-            }
-            QPushButton:pressed {
-                background-color: #c62828;
-            }
-        """)
+        self.btn_emg.setStyleSheet(QSS_FRAGMENTS["btn_emg"])
         
         # Reset Emergency - Distinct Style
         self.btn_reset = QPushButton("RESET EMERGENCY")
@@ -406,22 +429,7 @@ class CNCWindow(QMainWindow):
         self.btn_reset.setCursor(Qt.PointingHandCursor)
         self.btn_reset.setFixedHeight(60)
         self.btn_reset.setFixedWidth(180)
-        self.btn_reset.setStyleSheet("""
-            QPushButton {
-                background-color: #f57f17;
-                color: white;
-                font-weight: bold;
-                font-size: 14px;
-                border: 2px solid #f9a825;
-                border-radius: 8px;
-            }
-            QPushButton:hover {
-                background-color: #fbc02d;
-            }
-            QPushButton:pressed {
-                background-color: #f57f17;
-            }
-        """)
+        self.btn_reset.setStyleSheet(QSS_FRAGMENTS["btn_reset"])
         
         layout.addWidget(self.btn_emg, stretch=1)
         layout.addWidget(self.btn_reset)
@@ -433,8 +441,12 @@ class CNCWindow(QMainWindow):
         group = QGroupBox("Terminal & Signals")
         layout = QVBoxLayout()
         
-        self.text_terminal = QTextEdit()
+        # Append-only log: QPlainTextEdit's line layout is far cheaper than QTextEdit
+        self.text_terminal = QPlainTextEdit()
         self.text_terminal.setReadOnly(True)
+        self.text_terminal.setMaximumBlockCount(5000) # Bound memory of long sessions
+        self.text_terminal.setUndoRedoEnabled(False) # Read-only log, no undo history per append
+        self._term_scroll = self.text_terminal.verticalScrollBar()
         self.text_terminal.setStyleSheet("font-family: 'Consolas', 'Courier New'; font-size: 13px; color: #cfd8dc;")
         
         self.input_terminal = QLineEdit()
@@ -479,7 +491,7 @@ class CNCWindow(QMainWindow):
         layout_btns.addWidget(self.btn_stop_macro)
 
         btn_clear_macro = QPushButton("CLEAR")
-        btn_clear_macro.clicked.connect(lambda: self.text_macro.clear())
+        btn_clear_macro.clicked.connect(self.text_macro.clear)
         layout_btns.addWidget(btn_clear_macro)
         
         layout.addWidget(self.text_macro)
@@ -491,12 +503,28 @@ class CNCWindow(QMainWindow):
     # ------------------------------------------------------------------------
     # LOGIC
     # ------------------------------------------------------------------------
+    @pyqtSlot()
     def refresh_ports(self):
+        self._refresh_timer.start()
+
+    @pyqtSlot()
+    def _do_refresh_ports(self):
+        # Scan on the thread pool; _apply_ports fills the combo when done
+        self._port_scan = PortScanTask()
+        self._port_scan.signals.result.connect(self._apply_ports)
+        QThreadPool.globalInstance().start(self._port_scan)
+
+    @pyqtSlot(list)
+    def _apply_ports(self, devices):
+        if devices == self._last_ports:
+            return
+        self._last_ports = devices
+        self.combo_ports.blockSignals(True)
         self.combo_ports.clear()
-        ports = serial.tools.list_ports.comports()
-        for port in ports:
-            self.combo_ports.addItem(port.device)
+        self.combo_ports.addItems(devices)
+        self.combo_ports.blockSignals(False)
 
+    @pyqtSlot()
     def toggle_connection(self):
         if not self.serial_worker.is_running:
             port = self.combo_ports.currentText()
@@ -511,27 +539,58 @@ class CNCWindow(QMainWindow):
         else:
             self.serial_worker.disconnect_serial()
 
+    @pyqtSlot(bool)
     def on_connection_status_changed(self, connected):
         if connected:
             self.btn_connect.setText("DISCONNECT")
-            self.btn_connect.setStyleSheet("background-color: #4caf50; color: white;")
+            self.set_style_state(self.btn_connect, "connected")
             self.lbl_status.setText("CONNECTED")
-            self.lbl_status.setStyleSheet("color: #4caf50; font-weight: bold;")
+            self.set_style_state(self.lbl_status, "connected")
         else:
             self.btn_connect.setText("CONNECT")
-            self.btn_connect.setStyleSheet("") 
+            self.set_style_state(self.btn_connect, "")
             self.lbl_status.setText("DISCONNECTED")
-            self.lbl_status.setStyleSheet("color: #d32f2f; font-weight: bold;")
+            self.set_style_state(self.lbl_status, "disconnected")
+        self._sync_polling()
 
+    def set_style_state(self, widget, state):
+        """
+        Switch a widget between the [state="..."] rules of the dark theme (styles.py).
+        Only this widget is re-polished; no stylesheet is re-parsed.
+        """
+        widget.setProperty("state", state)
+        widget.style().unpolish(widget)
+        widget.style().polish(widget)
+
+    @pyqtSlot(list)
+    def on_serial_data_batch(self, lines):
+        for data in lines:
+            self.on_serial_data(data)
+
+    @pyqtSlot(str)
     def on_serial_data(self, data):
-        self.log(f"[RX] {data}")
-        
         # Parse Position
         # Format provided by user: +30.4,-065.32,-300.00
         # Regex: Look for 3 comma-separated numbers (float)
         
         # 1. New CSV Format
-        match_csv = re.search(r"([+-]?\d+(?:\.\d+)?),([+-]?\d+(?:\.\d+)?),([+-]?\d+(?:\.\d+)?)", data)
+        # Fast path: the whole line is exactly three numbers
+        parts = data.split(',')
+        if len(parts) == 3:
+            try:
+                x, y, z = float(parts[0]), float(parts[1]), float(parts[2])
+            except ValueError:
+                pass
+            else:
+                # Replies to our own position poll are not logged
+                if not self._pos_pending:
+                    self.log(f"[RX] {data}")
+                self.update_position_display(x, y, z)
+                return
+
+        self.log(f"[RX] {data}")
+
+        match_csv = self._re_pos_csv.search(data)
         if match_csv:
             try:
                 x = float(match_csv.group(1))
@@ -543,7 +602,7 @@ class CNCWindow(QMainWindow):
 
         # 2. Keep Grbl Status Format just in case: MPos:0.000,0.000,0.000
         if "MPos:" in data or "WPos:" in data:
-            match_grbl = re.search(r"(?:MPos|WPos):([-\d\.]+),([-\d\.]+),([-\d\.]+)", data)
+            match_grbl = self._re_grbl_pos.search(data)
             if match_grbl:
                 try:
                     x = float(match_grbl.group(1))
@@ -557,74 +616,117 @@ class CNCWindow(QMainWindow):
         # Looking for F, A, J, S, E values. 
         # Pattern assumption: F:1000 A:500 or F1000 A500
         # We'll use a generic finder for these keys.
-        # Check if we have labels first (in case UI not initialized fully)
-        if hasattr(self, 'lbl_motion_vals'):
-            # Regex to find Key:Value or KeyValue
-            # Matches F, A, J, S, E followed optionally by : then a number
-            params = re.findall(r"([FAJSE])[:\s]*(\d+(?:\.\d+)?)", data, re.IGNORECASE)
-            if params:
-                for key, val in params:
-                    u_key = key.upper()
-                    if u_key in self.lbl_motion_vals:
-                        self.lbl_motion_vals[u_key].setText(val)
-
+        # Position replies never get here (fast path above returns), and the
+        # labels exist before any RX since the left panel is built in init_ui.
+        # Regex to find Key:Value or KeyValue
+        # Matches F, A, J, S, E followed optionally by : then a number
+        for key, val in self._re_motion_param.findall(data):
+            key = key.upper()
+            # Firmware re-reports the same values on every query
+            if self._last_motion_vals.get(key) == val:
+                continue
+            self._last_motion_vals[key] = val
+            self.lbl_motion_vals[key].setText(val)
+
+    @pyqtSlot(str)
     def on_serial_error(self, error):
         self.log(f"[ERROR] {error}")
         QMessageBox.critical(self, "Serial Error", str(error))
 
+    @pyqtSlot(str)
     def log(self, message):
-        timestamp = time.strftime("%H:%M:%S")
-        # SAFETY CHECK: Ensure text_terminal exists
-        if not hasattr(self, 'text_terminal') or self.text_terminal is None:
-            print(f"[{timestamp}] {message}") # Fallback to console
+        timestamp = self._timestamp()
+        self._log_buf.append(f"[{timestamp}] {message}")
+        if not self._log_timer.isActive():
+            self._log_timer.start()
+
+    def _timestamp(self):
+        # strftime only when the wall-clock second changes
+        now = int(time.time())
+        if now != self._ts_epoch:
+            self._ts_epoch = now
+            self._ts_str = time.strftime("%H:%M:%S", time.localtime(now))
+        return self._ts_str
+
+    @pyqtSlot()
+    def _flush_log(self):
+        # Lines logged before the terminal is built stay queued until it is
+        if not self._log_buf or self.text_terminal is None:
             return
-            
-        self.text_terminal.append(f"[{timestamp}] {message}")
-        self.text_terminal.moveCursor(self.text_terminal.textCursor().End)
+        lines = "\n".join(self._log_buf)
+        self._log_buf.clear()
+        self.text_terminal.appendPlainText(lines)
+        # Follow the tail without building a QTextCursor per flush
+        self._term_scroll.setValue(self._term_scroll.maximum())
 
+    @pyqtSlot(str)
+    def _on_step_text_changed(self, text):
+        self.set_step(self.STEP_SIZES[text])
+
+    @pyqtSlot(float)
     def set_step(self, val):
         self.step_size = val
         self.log(f"Step size set to: {val} mm")
 
     # update_feed_label removed
 
+    @pyqtSlot(str)
     def send_command(self, cmd):
+        # User input may carry stray whitespace
+        self._send_trusted(cmd.strip())
+
+    def _send_trusted(self, cmd):
+        # cmd is built by the app itself: already clean, no strip needed
         if not self.serial_worker.is_running:
             self.log("[SYS] Not connected.")
             # For demonstration, log what would be sent even if not connected
             # self.log(f"(Mock) [TX] {cmd}") 
             return
 
-        cmd = cmd.strip()
         self.log(f"[TX] {cmd}")
+        # Keep ordering with any queued macro commands
+        self._flush_tx()
         self.serial_worker.write_data(cmd)
 
+    @pyqtSlot(str)
+    def queue_command(self, cmd):
+        if not self.serial_worker.is_running:
+            self.log("[SYS] Not connected.")
+            return
+
+        # MacroRunner emits commands already stripped
+        self.log(f"[TX] {cmd}")
+        self._tx_buf.append(cmd)
+        self._tx_len += len(cmd) + 1
+        if self._tx_len >= self.TX_FLUSH_BYTES:
+            self._flush_tx()
+        elif not self._tx_timer.isActive():
+            self._tx_timer.start()
+
+    @pyqtSlot()
+    def _flush_tx(self):
+        if not self._tx_buf:
+            return
+        self._tx_buf.append("") # Trailing newline
+        data = "\n".join(self._tx_buf).encode('utf-8')
+        self._tx_buf.clear()
+        self._tx_len = 0
+        self._tx_timer.stop()
+        self.serial_worker.write_data(data)
+
+    @pyqtSlot()
     def send_manual_command(self):
         cmd = self.input_terminal.text()
         if cmd:
             self.send_command(cmd)
             self.input_terminal.clear()
 
+    @pyqtSlot(str, int)
     def send_jog(self, axis, direction):
         # User requested: G90 move based on current UI position
         
-        # 1. Get current position for the requested axis from UI
-        current_val = 0.0
-        try:
-            if axis == 'X':
-                text = self.lbl_pos_x.text()
-            elif axis == 'Y':
-                text = self.lbl_pos_y.text()
-            elif axis == 'Z':
-                text = self.lbl_pos_z.text()
-            else:
-                text = "0"
-            
-            # Remove any non-numeric chars except . and - and +
-            # Actually float() handles whitespace, but let's be safe if "X: 10" is used (though it isn't here)
-            current_val = float(text)
-        except ValueError:
-            current_val = 0.0
+        # 1. Get current position for the requested axis (last reported value)
+        current_val = self._pos[axis]
             
         # 2. Calculate Target
         dist = self.step_size * direction
@@ -634,23 +736,27 @@ class CNCWindow(QMainWindow):
         # "VD ĐANG CLICK VÀO 1 THÌ GỬI LÀ G01 X..1."
         # We'll assume they mean target position.
         # Format: G90 G01 X<Target> F<Speed>
-        cmd = f"G01 {axis}{target:.3f}"
-        self.send_command(cmd)
+        cmd = self.JOG_TEMPLATES[axis].format(target)
+        self._send_trusted(cmd)
         
+    @pyqtSlot()
     def send_home(self):
         # Auto-off Manual Mode requested
         if not self.btn_mode.isChecked():
              self.btn_mode.setChecked(True) # This will trigger toggle_mode -> stop timer
-        self.send_command("G28")
+        self._send_trusted("G28")
         
+    @pyqtSlot()
     def send_emg(self):
         self.log("!!! EMERGENCY STOP !!!")
         if self.serial_worker.is_running:
-            self.send_command("M600 A4 B5") 
+            self._send_trusted("M600 A4 B5") 
 
+    @pyqtSlot()
     def send_reset(self):
-        self.send_command("M502")
+        self._send_trusted("M502")
 
+    @pyqtSlot()
     def run_macro(self):
         script = self.text_macro.toPlainText()
         if not script:
@@ -660,6 +766,7 @@ class CNCWindow(QMainWindow):
         self.macro_runner.start_macro(script, is_debug=False)
         self.update_macro_ui_state(running=True, debug=False)
 
+    @pyqtSlot()
     def start_debug(self):
         script = self.text_macro.toPlainText()
         if not script:
@@ -667,23 +774,23 @@ class CNCWindow(QMainWindow):
         self.macro_runner.start_macro(script, is_debug=True)
         self.update_macro_ui_state(running=True, debug=True)
         
+    @pyqtSlot()
     def step_macro(self):
         self.macro_runner.step()
         
+    @pyqtSlot()
     def stop_macro(self):
         self.macro_runner.stop_macro()
         # State update handled in on_macro_finished or here?
         # on_macro_finished is emitted by runner, so we rely on that.
 
+    @pyqtSlot()
     def on_macro_finished(self):
         self.log("Macro execution finished.")
         self.update_macro_ui_state(running=False, debug=False)
         
         # Clear highlight
-        cursor = self.text_macro.textCursor()
-        cursor.select(QTextCursor.Document)
-        fmt = QTextCharFormat()
-        cursor.setCharFormat(fmt) # Reset
+        self.text_macro.setExtraSelections([])
         
     def update_macro_ui_state(self, running: bool, debug: bool):
         """
@@ -705,32 +812,32 @@ class CNCWindow(QMainWindow):
             self.btn_stop_macro.setEnabled(False)
             self.btn_step_macro.setEnabled(False)
         
+    @pyqtSlot(int)
     def highlight_current_line(self, line_index):
         """
         Highlights the background of the current line in the macro editor 
         to act as a visual arrow/cursor.
+        Painted as an extra selection: the document itself is never reformatted.
         """
-        # Reset formatting first
-        cursor = self.text_macro.textCursor()
-        cursor.select(QTextCursor.Document)
-        fmt = QTextCharFormat()
-        fmt.setBackground(QColor("#15151a")) # Default dark bg
-        cursor.setCharFormat(fmt)
-        
-        # Highlight specific line
         doc = self.text_macro.document()
         block = doc.findBlockByNumber(line_index)
         
         if block.isValid():
-            cursor.setPosition(block.position())
-            cursor.select(QTextCursor.BlockUnderCursor)
-            
-            fmt.setBackground(QColor("#00695c")) # Teal Highlight
-            cursor.setCharFormat(fmt)
+            cursor = QTextCursor(block)
+
+            sel = self._hl_selection
+            sel.cursor = cursor
+            self.text_macro.setExtraSelections([sel])
             
             self.text_macro.setTextCursor(cursor)
             self.text_macro.ensureCursorVisible() 
 
+    @pyqtSlot(int, bool)
+    def _on_speed_toggled(self, val, checked):
+        if checked:
+            self.on_speed_changed(val)
+
+    @pyqtSlot(int)
     def on_speed_changed(self, val):
         # val is now percentage directly (20, 40, ..., 100)
         self.log(f"Speed Override: {val}%")
@@ -738,23 +845,81 @@ class CNCWindow(QMainWindow):
         # Update MacroRunner with speed override
         self.macro_runner.set_speed_override(val / 100.0)
 
+    @pyqtSlot()
     def request_motion_params(self):
         # User requested M220 I0 to get F, A, J, S, E params
         if self.serial_worker.is_running:
-            self.send_command("M220 I0")
+            self._send_trusted("M220 I0")
         else:
             self.log("Not connected!")
 
+    def start_polling(self):
+        self._polling = True
+        self._sync_polling()
+
+    def stop_polling(self):
+        self._polling = False
+        self._sync_polling()
+
+    def _sync_polling(self):
+        """
+        Run the position poll only in manual mode, while connected and while
+        the window is on screen; otherwise no timer is left running.
+        """
+        if (self._polling and self.serial_worker.is_running
+                and self.isVisible() and not self.isMinimized()):
+            if not self.timer_position.isActive() and not self._pos_watchdog.isActive():
+                self.timer_position.start()
+        else:
+            self._pos_pending = False
+            self.timer_position.stop()
+            self._pos_watchdog.stop()
+
+    def changeEvent(self, event):
+        if event.type() == QEvent.WindowStateChange:
+            self._sync_polling()
+        super().changeEvent(event)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self._sync_polling()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self._sync_polling()
+
+    @pyqtSlot()
     def request_position(self):
+        if not self._polling:
+            return
         if self.serial_worker.is_running:
             # Send '?' for status report. 
             # Note: We use write_data directly or send_command? 
             # send_command logs every [TX], which might spam the log every 200ms.
             # So we might want to bypass log, OR just accept the spam. 
             # Let's bypass log for polling to keep it clean.
+            self._pos_pending = True
+            # Keep ordering with any queued macro commands
+            self._flush_tx()
             self.serial_worker.write_data("Position")
+            self._pos_watchdog.start()
 
     def update_position_display(self, x, y, z):
+        if self._pos_pending:
+            # Poll answered: schedule the next one
+            self._pos_pending = False
+            self._pos_watchdog.stop()
+            if self._polling:
+                self.timer_position.start()
+
+        # Idle machine: same position as last time, nothing to repaint
+        lx, ly, lz = self._last_pos
+        if (lx is not None and abs(x - lx) < 1e-4
+                and abs(y - ly) < 1e-4 and abs(z - lz) < 1e-4):
+            return
+        self._last_pos = (x, y, z)
+        self._pos = {'X': x, 'Y': y, 'Z': z}
+
         # Sync to Macro Runner for #robot0.HOME_X/Y/Z variables
         self.macro_runner.update_machine_position(x, y, z)
         
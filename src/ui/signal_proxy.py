@@ -0,0 +1,30 @@
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+class SignalProxy(QObject):
+    """
+    Collects the values of a rapidly firing one-argument signal and
+    re-emits them as one list, at most rate_limit times per second.
+    """
+    batch_ready = pyqtSignal(list)
+
+    def __init__(self, signal, rate_limit=200, slot=None, parent=None):
+        super().__init__(parent)
+        self._pending = []
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(max(1, int(1000 / rate_limit)))
+        self._timer.timeout.connect(self._flush)
+
+        signal.connect(self._collect)
+        if slot is not None:
+            self.batch_ready.connect(slot)
+
+    def _collect(self, value):
+        self._pending.append(value)
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def _flush(self):
+        if self._pending:
+            batch, self._pending = self._pending, []
+            self.batch_ready.emit(batch)
@@ -1,22 +1,29 @@
 # Professional Dark Theme QSS
+import re
+from functools import lru_cache
+from string import Template
+from PyQt5.QtGui import QColor, QFont, QPalette
 
-DARK_THEME_QSS = """
-QMainWindow {
-    background-color: #1e1e24;
-    color: #e0e0e0;
-}
-QWidget {
-    font-family: 'Segoe UI', 'Roboto', sans-serif;
-    font-size: 14px;
-    color: #e0e0e0;
+# Shared theme values, substituted into _TEMPLATE ($NAME) at import
+_VARS = {
+    "CYAN": "#00bcd4",      # Accent
+    "BG": "#1e1e24",        # Window background
+    "PANEL": "#25252b",     # Group box background
+    "INPUT_BG": "#15151a",  # Inputs, radio indicators
+    "BORDER": "#3a3a45",
+    "BUTTON": "#34343d",
+    "TEXT": "#e0e0e0",
+    "RADIUS": "4px",        # Buttons and inputs
 }
+
+_TEMPLATE = """
 QGroupBox {
-    border: 1px solid #3a3a45;
+    border: 1px solid $BORDER;
     border-radius: 8px;
     margin-top: 1.2em;
     font-weight: bold;
-    color: #00bcd4; /* Cyan accent */
-    background-color: #25252b;
+    color: $CYAN;
+    background-color: $PANEL;
 }
 QGroupBox::title {
     subcontrol-origin: margin;
@@ -25,9 +32,9 @@ QGroupBox::title {
     left: 10px;
 }
 QPushButton {
-    background-color: #34343d;
+    background-color: $BUTTON;
     border: none;
-    border-radius: 4px;
+    border-radius: $RADIUS;
     padding: 8px 16px;
     color: #ffffff;
     font-weight: bold;
@@ -36,60 +43,67 @@ QPushButton:hover {
     background-color: #454552;
 }
 QPushButton:pressed {
-    background-color: #00bcd4; /* Cyan */
+    background-color: $CYAN;
     color: #121212;
 }
 QPushButton:disabled {
     background-color: #2a2a30;
     color: #555;
 }
-/* Special Buttons */
-QPushButton#btn_emg {
-    background-color: #d32f2f; /* Red */
-    border-radius: 8px;
-    font-size: 16px;
-    padding: 15px;
+/* Special Buttons (EMG / reset / get-params: see QSS_FRAGMENTS) */
+QPushButton#btn_home {
+    background-color: #1976d2; /* Blue */
 }
-QPushButton#btn_emg:hover {
-    background-color: #b71c1c;
+
+/* State-driven widgets: dynamic "state" property set by CNCWindow.set_style_state */
+QPushButton#btn_mode[state="auto"] {
+    background-color: #00897b; /* Teal */
 }
-QPushButton#btn_emg:pressed {
-    background-color: #ff5252;
+QPushButton#btn_mode[state="manual"] {
+    background-color: $BUTTON;
 }
-QPushButton#btn_home {
-    background-color: #1976d2; /* Blue */
+QPushButton#btn_connect[state="connected"] {
+    background-color: #4caf50; /* Green */
+    color: white;
+}
+QLabel#lbl_status {
+    color: #757575;
+    font-weight: bold;
+    font-size: 14px;
+}
+QLabel#lbl_status[state="connected"] {
+    color: #4caf50;
 }
-QPushButton#btn_reset {
-    background-color: #fbc02d; /* Yellow/Amber */
-    color: #000;
+QLabel#lbl_status[state="disconnected"] {
+    color: #d32f2f;
 }
 
 /* Jog Buttons */
-QPushButton.jog-btn {
+QPushButton[jog="true"] {
     background-color: #2d2d36;
-    border: 2px solid #3a3a45;
+    border: 2px solid $BORDER;
     border-radius: 5px;
     font-size: 16px;
 }
-QPushButton.jog-btn:pressed {
-    background-color: #00bcd4;
-    border-color: #00bcd4;
+QPushButton[jog="true"]:pressed {
+    background-color: $CYAN;
+    border-color: $CYAN;
 }
 
 /* Inputs */
-QLineEdit, QTextEdit, QComboBox {
-    background-color: #15151a;
-    border: 1px solid #3a3a45;
-    border-radius: 4px;
+QLineEdit, QTextEdit, QPlainTextEdit, QComboBox {
+    background-color: $INPUT_BG;
+    border: 1px solid $BORDER;
+    border-radius: $RADIUS;
     padding: 5px;
     color: #00e5ff; /* Bright Cyan text */
 }
-QLineEdit:focus, QTextEdit:focus {
-    border: 1px solid #00bcd4;
+QLineEdit:focus, QTextEdit:focus, QPlainTextEdit:focus {
+    border: 1px solid $CYAN;
 }
 QScrollBar:vertical {
     border: none;
-    background: #1e1e24;
+    background: $BG;
     width: 10px;
     margin: 0px;
 }
@@ -110,14 +124,137 @@ QRadioButton::indicator {
     height: 18px;
 }
 QRadioButton::indicator:unchecked {
-    image: none;
-    background-color: #15151a;
+    background-color: $INPUT_BG;
     border: 2px solid #555;
     border-radius: 9px;
 }
 QRadioButton::indicator:checked {
-    background-color: #00bcd4;
-    border: 2px solid #00bcd4;
+    background-color: $CYAN;
+    border: 2px solid $CYAN;
     border-radius: 9px;
 }
 """
+
+def dark_palette():
+    """
+    Base colors of the theme as a QPalette (set on the QApplication).
+    Palette roles are plain lookups, so the stylesheet only carries what a
+    palette cannot express (borders, radii, padding, pseudo-states).
+    """
+    pal = QPalette()
+    pal.setColor(QPalette.Window, QColor(_VARS["BG"]))
+    pal.setColor(QPalette.WindowText, QColor(_VARS["TEXT"]))
+    pal.setColor(QPalette.Base, QColor(_VARS["INPUT_BG"]))
+    pal.setColor(QPalette.AlternateBase, QColor(_VARS["PANEL"]))
+    pal.setColor(QPalette.Text, QColor(_VARS["TEXT"]))
+    pal.setColor(QPalette.Button, QColor(_VARS["BUTTON"]))
+    pal.setColor(QPalette.ButtonText, QColor("#ffffff"))
+    pal.setColor(QPalette.Highlight, QColor(_VARS["CYAN"]))
+    pal.setColor(QPalette.HighlightedText, QColor("#121212"))
+    return pal
+
+def _minify(qss):
+    """
+    Drop comments and redundant whitespace so Qt's CSS parser has less
+    text to walk; the rules themselves are unchanged.
+    """
+    qss = re.sub(r"/\*.*?\*/", "", qss, flags=re.S)
+    qss = re.sub(r"\s+", " ", qss)
+    qss = re.sub(r"\s*([{};,])\s*", r"\1", qss)
+    qss = re.sub(r"\s*:\s+", ":", qss) # "color: x" -> "color:x"; selector pseudo-states have no spaces
+    return qss.replace(";}", "}").strip()
+
+# Per-widget sheets, keyed by object name. Installed on that widget only,
+# so these rules are not matched against the rest of the tree.
+_RAW_FRAGMENTS = {
+    "btn_emg": """
+        QPushButton {
+            background-color: #d32f2f;
+            color: white;
+            font-weight: bold;
+            font-size: 16px;
+            border: 2px solid #b71c1c;
+            border-radius: 8px;
+            padding: 15px;
+        }
+        QPushButton:hover {
+            background-color: #e53935;
+        }
+        QPushButton:pressed {
+            background-color: #c62828;
+        }
+    """,
+    "btn_reset": """
+        QPushButton {
+            background-color: #f57f17;
+            color: white;
+            font-weight: bold;
+            font-size: 14px;
+            border: 2px solid #f9a825;
+            border-radius: 8px;
+        }
+        QPushButton:hover {
+            background-color: #fbc02d;
+        }
+        QPushButton:pressed {
+            background-color: #f57f17;
+        }
+    """,
+    "btn_get_params": """
+        QPushButton {
+            background-color: #5c6bc0;
+            color: white;
+            font-weight: bold;
+            border-radius: 5px;
+            padding: 5px;
+        }
+        QPushButton:hover { background-color: #7986cb; }
+    """,
+}
+
+@lru_cache(maxsize=1)
+def dark_theme_qss():
+    """
+    The application stylesheet, built (substituted + minified) on first use
+    rather than at import.
+    """
+    return _minify(Template(_TEMPLATE).substitute(_VARS))
+
+# Fragments are small and needed while building the window: minified at import
+QSS_FRAGMENTS = {name: _minify(qss) for name, qss in _RAW_FRAGMENTS.items()}
+
+_APPLIED = object() # Marks widgets that already carry dark_theme_qss()
+
+def apply_dark_theme(widget):
+    """
+    Set dark_theme_qss() on widget once; repeat calls are no-ops instead of
+    re-parsing the sheet and re-polishing the whole widget tree.
+    """
+    if getattr(widget, "_qss_token", None) is _APPLIED:
+        return
+    widget.setStyleSheet(dark_theme_qss())
+    widget._qss_token = _APPLIED
+
+def dark_font():
+    """
+    Default UI font: Segoe UI, then Roboto, then the system default; 14px.
+    Set on the QApplication instead of a universal QWidget rule, which Qt
+    would have to match against every widget in the tree.
+    """
+    # No style hint: it would be inherited by widgets whose own sheet only
+    # sets font-family (terminal, macro editor) and turn their monospace
+    # fallback into sans-serif
+    font = QFont()
+    font.setFamilies(["Segoe UI", "Roboto"])
+    font.setPixelSize(14)
+    return font
+
+def install(app):
+    """
+    Install the theme on the QApplication: palette, font and dark_theme_qss().
+    This is the only place the global sheet is applied; every window and
+    dialog shares the application's parsed rules instead of re-applying them.
+    """
+    app.setPalette(dark_palette())
+    app.setFont(dark_font())
+    apply_dark_theme(app)